@@ -0,0 +1,51 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+# Offline batch scoring: answers every query in a JSON Lines file through
+# the same tiers as /query/batch, writing one result line per input line,
+# in input order.
+
+parser = argparse.ArgumentParser(description="Answer a JSON Lines file of queries in batches.")
+parser.add_argument("input", help="JSON Lines file, one object per query")
+parser.add_argument("-o", "--output", help="results file (default: stdout)")
+parser.add_argument("--field", default="query", help="key holding the query text")
+parser.add_argument("--id-field", help="key copied into each result as \"id\"")
+parser.add_argument("--batch-size", type=int, default=256)
+args = parser.parse_args()
+
+import main  # noqa: E402
+
+with open(args.input, "r") as f:
+    records = [json.loads(line) for line in f if line.strip()]
+
+
+async def run(out):
+    for start in range(0, len(records), args.batch_size):
+        batch = records[start:start + args.batch_size]
+        queries = [str(record.get(args.field) or "") for record in batch]
+
+        results, query_embeddings, tiers = await main.answer_batch_before_generation(queries)
+
+        async for i, result in main.answer_batch(queries, results, query_embeddings, tiers):
+            line = {"index": start + i}
+            if args.id_field:
+                line["id"] = batch[i].get(args.id_field)
+            line.update(result)
+
+            out.write(json.dumps(line) + "\n")
+            out.flush()
+
+
+started = time.perf_counter()
+
+out = open(args.output, "w") if args.output else sys.stdout
+try:
+    asyncio.run(run(out))
+finally:
+    if out is not sys.stdout:
+        out.close()
+
+print(f"✅ Answered {len(records)} queries in {time.perf_counter() - started:.1f}s.", file=sys.stderr)
@@ -0,0 +1,322 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Throughput, latency percentiles and peak memory for each pipeline stage
+# in isolation and for the full /query flow, under a fixed query mix.
+# Save a run with --json and pass it to --compare on a later commit to
+# flag regressions.
+
+parser = argparse.ArgumentParser(description="Benchmark the tiered query pipeline.")
+parser.add_argument("--stages", default="guardrails,dataset,retrieve,slm,rag,pipeline")
+parser.add_argument("--concurrency", default="1,8", help="comma-separated client counts")
+parser.add_argument("--requests", type=int, help="calls per stage and concurrency (default: per stage)")
+parser.add_argument("--warmup", type=int, default=5, help="untimed calls before each run")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--url", help="load-test a running server's /query instead of the in-process pipeline")
+parser.add_argument("--json", help="write results to this file")
+parser.add_argument("--compare", help="baseline results file to compare against")
+parser.add_argument("--current", help="compare this saved results file instead of running")
+parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative slowdown")
+args = parser.parse_args()
+
+# Calls per run when --requests is not given; generation is far slower
+REQUESTS = {
+    "guardrails": 5000,
+    "dataset": 500,
+    "retrieve": 500,
+    "slm": 48,
+    "rag": 48,
+    "pipeline": 200,
+}
+
+# Share of the mixed workload per source
+MIX = {"dataset": 0.5, "rag": 0.25, "slm": 0.25}
+
+# Lead-ins that turn router examples into unseen (synthetic) misses
+LEAD_INS = ["", "Hi, ", "Quick question: ", "As a salaried customer, ", "For my joint account, "]
+
+
+# ---------------------------------------------------
+# 🔹 Query Mix
+# ---------------------------------------------------
+
+def load_queries(seed: int) -> dict:
+    """
+    Queries per source: "dataset" holds the generate_dataset.py
+    questions of every category, "rag" and "slm" hold synthetic misses
+    built from the router examples of that tier.
+    """
+
+    rng = random.Random(seed)
+
+    with open("data/alpaca_dataset.json", "r") as f:
+        dataset = [item["instruction"] for item in json.load(f)]
+    with open("data/router_examples.json", "r") as f:
+        examples = json.load(f)
+
+    def misses(tier):
+        queries = [lead + query[0].lower() + query[1:] if lead else query
+                   for query in examples[tier] for lead in LEAD_INS]
+        rng.shuffle(queries)
+        return queries
+
+    return {"dataset": dataset, "rag": misses("rag"), "slm": misses("slm")}
+
+
+def mixed(queries: dict, count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    sources = list(MIX)
+    picks = rng.choices(sources, weights=[MIX[source] for source in sources], k=count)
+    return [rng.choice(queries[source]) for source in picks]
+
+
+def only(queries: list, count: int) -> list:
+    return [queries[i % len(queries)] for i in range(count)]
+
+
+# ---------------------------------------------------
+# 🔹 Stages Under Test
+# ---------------------------------------------------
+
+def stage_calls():
+    """
+    name -> (call taking one query, query source). Imported here so
+    --current comparisons do not load any model.
+    """
+
+    import main
+    from services import rag
+    from services.guardrails import apply_guardrails
+    from services.model import generate_rag_response, generate_slm_response
+    from services.similarity import search_similar_query
+    from services.startup import startup
+
+    startup.load(warm=True)
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="benchmark-loop", daemon=True).start()
+
+    def pipeline(query):
+        # Same coroutine the /query route awaits, on one shared event loop
+        request = main.handle_query(main.QueryRequest(query=query), main.Response())
+        future = asyncio.run_coroutine_threadsafe(request, loop)
+        result = future.result()
+
+        # Overload comes back as a 503 response, as over HTTP
+        if getattr(result, "status_code", 200) >= 400:
+            raise RuntimeError(f"HTTP {result.status_code}")
+        return result
+
+    def reset():
+        main.response_cache.clear()
+        main.semantic_cache.invalidate()
+
+    calls = {
+        "guardrails": (apply_guardrails, "mixed"),
+        "dataset": (search_similar_query, "mixed"),
+        "retrieve": (rag.retrieve, "mixed"),
+        "slm": (generate_slm_response, "slm"),
+        "rag": (generate_rag_response, "rag"),
+        "pipeline": (pipeline, "mixed"),
+    }
+    return calls, reset
+
+
+def http_call(url: str):
+    def call(query):
+        request = urllib.request.Request(
+            url.rstrip("/") + "/query",
+            data=json.dumps({"query": query}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+    return call
+
+
+# ---------------------------------------------------
+# 🔹 Load Generator
+# ---------------------------------------------------
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_load(call, queries: list, concurrency: int) -> dict:
+    """
+    Send every query through call from concurrency client threads,
+    each waiting for its answer before sending the next.
+    """
+
+    latencies = []
+    errors = 0
+
+    def timed(query):
+        start = time.perf_counter()
+        try:
+            call(query)
+            failed = False
+        except Exception:
+            failed = True
+        return (time.perf_counter() - start) * 1000, failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for latency, failed in pool.map(timed, queries):
+            latencies.append(latency)
+            errors += failed
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": len(queries),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(queries) / elapsed, 2),
+        "latency_ms": {
+            "mean": round(float(np.mean(latencies)), 3),
+            "p50": round(float(np.percentile(latencies, 50)), 3),
+            "p95": round(float(np.percentile(latencies, 95)), 3),
+            "p99": round(float(np.percentile(latencies, 99)), 3),
+            "max": round(float(np.max(latencies)), 3),
+        },
+    }
+
+
+def run_benchmark() -> dict:
+    queries = load_queries(args.seed)
+    stages = args.stages.split(",")
+
+    if args.url:
+        calls, reset = {"pipeline": (http_call(args.url), "mixed")}, (lambda: None)
+        stages = ["pipeline"]
+    else:
+        calls, reset = stage_calls()
+
+    results = []
+    for stage in stages:
+        call, source = calls[stage]
+
+        for concurrency in [int(n) for n in args.concurrency.split(",")]:
+            count = args.requests or REQUESTS[stage]
+            if source == "mixed":
+                batch = mixed(queries, count + args.warmup, args.seed)
+            else:
+                batch = only(queries[source], count + args.warmup)
+
+            # Every run starts from empty caches so runs are comparable
+            reset()
+            for query in batch[:args.warmup]:
+                call(query)
+
+            result = run_load(call, batch[args.warmup:], concurrency)
+            results.append({
+                "stage": stage,
+                "concurrency": concurrency,
+                **result,
+                "peak_rss_mb": peak_rss_mb(),
+            })
+
+            latency = result["latency_ms"]
+            print(
+                f"{stage:<12}{concurrency:>6}{result['throughput_rps']:>12.1f}"
+                f"{latency['p50']:>10.2f}{latency['p95']:>10.2f}{latency['p99']:>10.2f}"
+                f"{results[-1]['peak_rss_mb']:>10.1f}{result['errors']:>8}",
+                flush=True,
+            )
+
+    return {"meta": run_metadata(), "results": results}
+
+
+def run_metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "seed": args.seed,
+        "url": args.url,
+        "mix": MIX,
+    }
+
+
+# ---------------------------------------------------
+# 🔹 Compare Against a Baseline
+# ---------------------------------------------------
+
+def compare(baseline: dict, current: dict) -> int:
+    """
+    Print relative changes per (stage, concurrency) and return the
+    number of regressions beyond the tolerance.
+    """
+
+    before = {(row["stage"], row["concurrency"]): row for row in baseline["results"]}
+    regressions = 0
+
+    print(f"\nBaseline {baseline['meta'].get('commit')} -> current {current['meta'].get('commit')}"
+          f"   (tolerance {args.tolerance:.0%})")
+    print(f"{'stage':<12}{'conc':>6}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'rss':>10}")
+
+    for row in current["results"]:
+        old = before.get((row["stage"], row["concurrency"]))
+        if old is None:
+            continue
+
+        def change(new_value, old_value):
+            return (new_value - old_value) / old_value if old_value else 0.0
+
+        throughput = change(row["throughput_rps"], old["throughput_rps"])
+        latencies = {p: change(row["latency_ms"][p], old["latency_ms"][p]) for p in ("p50", "p95", "p99")}
+        rss = change(row["peak_rss_mb"], old["peak_rss_mb"])
+
+        regressed = throughput < -args.tolerance or latencies["p95"] > args.tolerance
+        regressions += regressed
+
+        print(
+            f"{row['stage']:<12}{row['concurrency']:>6}{throughput:>+10.1%}"
+            f"{latencies['p50']:>+10.1%}{latencies['p95']:>+10.1%}{latencies['p99']:>+10.1%}{rss:>+10.1%}"
+            + ("   ⚠️ regression" if regressed else "")
+        )
+
+    return regressions
+
+
+if args.current:
+    with open(args.current, "r") as f:
+        report = json.load(f)
+else:
+    print(f"{'stage':<12}{'conc':>6}{'rps':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rss MB':>10}{'errors':>8}")
+    report = run_benchmark()
+
+if args.json:
+    with open(args.json, "w") as f:
+        json.dump(report, f, indent=4)
+
+if args.compare:
+    with open(args.compare, "r") as f:
+        regressions = compare(json.load(f), report)
+    if regressions:
+        print(f"❌ {regressions} regression(s) beyond {args.tolerance:.0%}.")
+        sys.exit(1)
+    print("✅ No regressions.")
@@ -0,0 +1,21 @@
+import sys
+
+from services.rag import build_index, update_index
+from services.router import build_router
+from services.similarity import build_dataset_index
+
+# Build the on-disk FAISS artifacts before starting the API.
+# Workers load these files instead of re-embedding at import time.
+# The RAG index is updated incrementally; pass --full to rebuild it.
+
+# Tier 1: Dataset similarity index
+build_dataset_index()
+
+# Embedding router (block / dataset / RAG / SLM)
+build_router()
+
+# Tier 3: RAG policy index
+if "--full" in sys.argv:
+    build_index()
+else:
+    update_index()
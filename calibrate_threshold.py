@@ -0,0 +1,75 @@
+import json
+
+from services import similarity
+from services.embeddings import EMBEDDING_MODEL_NAME, SIMILARITY_MODE, encode_texts, to_similarity
+
+# Re-calibrates the Tier 1 match threshold on a held-out paraphrase set.
+# Each item is a rephrased customer question and the dataset instruction
+# it paraphrases (null for questions the dataset must NOT answer).
+
+EVAL_PATH = "data/paraphrase_eval.json"
+
+# A wrong dataset answer is worse than falling through to RAG / SLM
+TARGET_PRECISION = 1.0
+
+similarity.load_dataset_index()
+
+with open(EVAL_PATH, "r") as f:
+    items = json.load(f)
+
+with open(similarity.DATASET_PATH, "r") as f:
+    expected_responses = {item["instruction"]: item["output"] for item in json.load(f)}
+
+query_embeddings = encode_texts([item["query"] for item in items])
+distances, indices = similarity.index.search(query_embeddings, 1)
+scores = to_similarity(distances[:, 0])
+
+# (score, top match is the right answer, item should match)
+results = []
+for item, score, idx in zip(items, scores, indices[:, 0]):
+    expected = expected_responses.get(item["paraphrase_of"])
+    correct = expected is not None and similarity.responses[idx] == expected
+    results.append((float(score), correct, expected is not None))
+
+positives = sum(1 for _, _, should_match in results if should_match) or 1
+
+
+def evaluate(threshold):
+    matched = [correct for score, correct, _ in results if score >= threshold]
+    hits = sum(matched)
+    precision = hits / len(matched) if matched else 1.0
+    recall = hits / positives
+    return precision, recall
+
+
+default_threshold = similarity.DEFAULT_THRESHOLDS[SIMILARITY_MODE]
+default_precision, default_recall = evaluate(default_threshold)
+
+# Every observed score is a candidate cut-off; keep the one with the
+# best recall at the target precision (ties go to the stricter value)
+best = None
+for threshold in sorted({score for score, _, _ in results}):
+    precision, recall = evaluate(threshold)
+    if precision >= TARGET_PRECISION and (best is None or recall >= best[2]):
+        best = (threshold, precision, recall)
+
+print(f"Mode: {SIMILARITY_MODE}   Items: {len(results)}")
+print(f"Default    threshold={default_threshold:.3f}  precision={default_precision:.3f}  recall={default_recall:.3f}")
+
+if best is None:
+    print("No threshold reaches the target precision. Keeping the default.")
+else:
+    threshold, precision, recall = best
+    print(f"Calibrated threshold={threshold:.3f}  precision={precision:.3f}  recall={recall:.3f}")
+
+    with open(similarity.THRESHOLD_PATH, "w") as f:
+        json.dump({
+            "mode": SIMILARITY_MODE,
+            "model": EMBEDDING_MODEL_NAME,
+            "threshold": round(threshold, 4),
+            "precision": round(precision, 4),
+            "recall": round(recall, 4),
+            "items": len(results),
+        }, f, indent=4)
+
+    print(f"Saved to {similarity.THRESHOLD_PATH}")
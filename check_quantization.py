@@ -0,0 +1,96 @@
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from services import model as slm
+from services.embeddings import encode_texts, load_embedding_model
+from services.generation import GenerationEngine
+from services.similarity import DATASET_PATH
+
+# Parity check for the int8 backends against fp32. The SLM must give
+# the same post-processed answers on the dataset prompts; the MiniLM
+# encoder must keep its vectors and nearest dataset questions.
+# Exits non-zero when a backend falls below the thresholds.
+
+EVAL_PATH = "data/paraphrase_eval.json"
+
+parser = argparse.ArgumentParser(description="Compare int8 inference backends with fp32.")
+parser.add_argument("--limit", type=int, default=50, help="dataset prompts to generate for")
+parser.add_argument("--min-match", type=float, default=0.9, help="required share of identical SLM answers")
+parser.add_argument("--min-top1", type=float, default=0.98, help="required nearest-question agreement")
+parser.add_argument("--json", help="write results to this file")
+args = parser.parse_args()
+
+with open(DATASET_PATH, "r") as f:
+    dataset = json.load(f)
+
+with open(EVAL_PATH, "r") as f:
+    eval_queries = [item["query"] for item in json.load(f)]
+
+instructions = list(dict.fromkeys(item["instruction"] for item in dataset))
+report = {}
+
+
+# ---------------------------------------------------
+# 🔹 SLM: post-processed answers
+# ---------------------------------------------------
+
+slm.load_slm()
+prompts = [slm._build_slm_prompt(query) for query in instructions[:args.limit]]
+answers = {}
+
+for backend in ("fp32", "int8"):
+    engine = GenerationEngine(slm.load_model(backend), slm.tokenizer, stop_criteria=slm.engine.stop_criteria)
+
+    started = time.perf_counter()
+    futures = [engine.submit(prompt, 100, tier=backend) for prompt in prompts]
+    answers[backend] = [slm._post_process(slm._trim_stop_markers(f.result())) for f in futures]
+    elapsed = time.perf_counter() - started
+
+    report[f"slm_{backend}_seconds"] = round(elapsed, 2)
+
+matches = sum(a == b for a, b in zip(answers["fp32"], answers["int8"]))
+report["slm_match_rate"] = round(matches / len(prompts), 4)
+
+print(f"SLM: {matches}/{len(prompts)} identical answers, "
+      f"fp32 {report['slm_fp32_seconds']}s vs int8 {report['slm_int8_seconds']}s")
+
+
+# ---------------------------------------------------
+# 🔹 MiniLM: vectors and nearest dataset question
+# ---------------------------------------------------
+
+vectors = {}
+for backend in ("fp32", "int8"):
+    encoder = load_embedding_model(backend)
+    started = time.perf_counter()
+    vectors[backend] = (encode_texts(instructions, encoder), encode_texts(eval_queries, encoder))
+    report[f"embedding_{backend}_seconds"] = round(time.perf_counter() - started, 2)
+
+
+def _unit(matrix):
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+corpus_cosine = np.sum(_unit(vectors["fp32"][0]) * _unit(vectors["int8"][0]), axis=1)
+top1 = {
+    backend: np.argmax(queries @ corpus.T, axis=1)
+    for backend, (corpus, queries) in vectors.items()
+}
+report["embedding_min_cosine"] = round(float(corpus_cosine.min()), 4)
+report["embedding_top1_agreement"] = round(float(np.mean(top1["fp32"] == top1["int8"])), 4)
+
+print(f"MiniLM: min cosine to fp32 {report['embedding_min_cosine']}, "
+      f"top-1 agreement {report['embedding_top1_agreement']}, "
+      f"fp32 {report['embedding_fp32_seconds']}s vs int8 {report['embedding_int8_seconds']}s")
+
+if args.json:
+    with open(args.json, "w") as f:
+        json.dump(report, f, indent=2)
+
+passed = report["slm_match_rate"] >= args.min_match and report["embedding_top1_agreement"] >= args.min_top1
+print("✅ int8 backends match fp32." if passed else "⚠️ int8 backends diverge from fp32.")
+sys.exit(0 if passed else 1)
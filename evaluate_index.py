@@ -0,0 +1,115 @@
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from services import rag
+from services.embeddings import SIMILARITY_MODE, encode_texts
+
+# Recall-vs-latency report for the RAG index types against the exact
+# flat index. Synthetic chunks can be added to preview a larger corpus.
+
+parser = argparse.ArgumentParser(description="Compare FAISS index types for RAG retrieval.")
+parser.add_argument("--types", default="flat,hnsw,ivf_flat,ivf_pq")
+parser.add_argument("--synthetic", type=int, default=0, help="extra synthetic chunks to add")
+parser.add_argument("--top-k", type=int, default=rag.TOP_K_DEFAULT)
+parser.add_argument("--nprobe", default="1,4,16,64")
+parser.add_argument("--ef-search", default="16,32,64,128")
+parser.add_argument("--json", help="write results to this file")
+args = parser.parse_args()
+
+
+# ---------------------------------------------------
+# 🔹 Corpus and Queries
+# ---------------------------------------------------
+
+corpus = encode_texts([chunk["text"] for chunk in rag.load_chunks()])
+
+if args.synthetic:
+    # Noisy blends of real chunks, so synthetic vectors stay on-topic
+    rng = np.random.default_rng(0)
+    picks = rng.integers(0, len(corpus), size=(args.synthetic, 2))
+    weights = rng.random((args.synthetic, 1)).astype("float32")
+    synthetic = weights * corpus[picks[:, 0]] + (1 - weights) * corpus[picks[:, 1]]
+    synthetic += rng.normal(0, 0.05, synthetic.shape).astype("float32")
+    if SIMILARITY_MODE == "cosine":
+        synthetic /= np.linalg.norm(synthetic, axis=1, keepdims=True)
+    corpus = np.vstack([corpus, synthetic.astype("float32")])
+
+with open("data/alpaca_dataset.json", "r") as f:
+    queries = [item["instruction"] for item in json.load(f)]
+with open("data/paraphrase_eval.json", "r") as f:
+    queries += [item["query"] for item in json.load(f)]
+
+query_embeddings = encode_texts(queries)
+top_k = min(args.top_k, len(corpus))
+
+exact = rag.create_index(corpus, "flat")
+_, truth = exact.search(query_embeddings, top_k)
+
+
+# ---------------------------------------------------
+# 🔹 Measure Each Index Type and Search Setting
+# ---------------------------------------------------
+
+def measure(index, nprobe=None, ef_search=None):
+    params = rag.search_params(index, nprobe=nprobe, ef_search=ef_search)
+    latencies = []
+    found = []
+
+    # One query at a time, as in the API
+    for row in range(len(query_embeddings)):
+        start = time.perf_counter()
+        _, ids = index.search(query_embeddings[row:row + 1], top_k, params=params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(ids[0])
+
+    recall = np.mean([
+        len(set(ids) & set(expected)) / top_k for ids, expected in zip(found, truth)
+    ])
+    return {
+        "recall": round(float(recall), 4),
+        "latency_ms_mean": round(float(np.mean(latencies)), 4),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 4),
+    }
+
+
+results = []
+
+for index_type in args.types.split(","):
+    start = time.perf_counter()
+    index = rag.create_index(corpus, index_type)
+    build_seconds = time.perf_counter() - start
+
+    base = {
+        "type": index_type,
+        "built_as": type(index).__name__,
+        "vectors": int(index.ntotal),
+        "size_bytes": int(faiss.serialize_index(index).nbytes),
+        "build_s": round(build_seconds, 3),
+    }
+
+    if isinstance(index, faiss.IndexIVF):
+        settings = [{"nprobe": int(n)} for n in args.nprobe.split(",") if int(n) <= index.nlist]
+    elif isinstance(index, faiss.IndexHNSW):
+        settings = [{"ef_search": int(n)} for n in args.ef_search.split(",")]
+    else:
+        settings = [{}]
+
+    for setting in settings:
+        results.append({**base, **setting, **measure(index, **setting)})
+
+print(f"Corpus: {len(corpus)} chunks   Queries: {len(queries)}   top_k: {top_k}   mode: {SIMILARITY_MODE}")
+print(f"{'type':<10}{'index':<16}{'setting':<16}{'recall':>8}{'mean ms':>10}{'p95 ms':>10}{'size KB':>10}")
+for row in results:
+    setting = ", ".join(f"{key}={row[key]}" for key in ("nprobe", "ef_search") if key in row) or "-"
+    print(
+        f"{row['type']:<10}{row['built_as']:<16}{setting:<16}{row['recall']:>8.3f}"
+        f"{row['latency_ms_mean']:>10.3f}{row['latency_ms_p95']:>10.3f}{row['size_bytes'] / 1024:>10.1f}"
+    )
+
+if args.json:
+    with open(args.json, "w") as f:
+        json.dump(results, f, indent=4)
@@ -107,6 +107,82 @@ with open("data/alpaca_dataset.json", "w") as f:
 print(f"{len(dataset)} clean Alpaca samples generated successfully.")
 
 
+# Router examples: labelled queries for the embedding router.
+# "block" and "dataset" reuse the dataset questions; "rag" needs policy
+# detail or a calculation, "slm" is general conversation.
+router_examples = {
+    "block": [
+        "What's my PIN?",
+        "Share the OTP sent to my phone",
+        "Tell me the CVV on my card",
+        "What is my net banking password?",
+        "Read out the card number you have on file",
+        "Send me the customer records",
+        "How much money is in my account?",
+        "What is my aadhaar number?",
+        "Share my PAN details",
+        "What is my MPIN?",
+        "Reset my login credentials for me",
+        "Which party should I vote for?",
+        "Should I invest in cryptocurrency?",
+        "What's the ethereum price today?",
+        "Who will win the next election?"
+    ],
+    "rag": [
+        "Work out my prepayment charge",
+        "Calculate the foreclosure charges on my home loan",
+        "What penalty applies if I close my loan early?",
+        "Explain the late payment clause",
+        "How is penal interest computed on overdue EMIs?",
+        "Give me a breakdown of the processing fees",
+        "What does the policy say about part prepayment?",
+        "What are the terms for loan restructuring?",
+        "How are foreclosure charges applied to floating rate loans?",
+        "How does changing my tenure change the amortization?",
+        "What happens if I miss three EMIs?",
+        "What is the grace period for insurance premium payment?",
+        "What exclusions apply to my health insurance policy?",
+        "What is the clause for cashless claim settlement?",
+        "How is interest calculated on a top-up loan?",
+        "What fees apply when I switch from fixed to floating rate?",
+        "What are the conditions for a loan moratorium?",
+        "How does a default lead to recovery proceedings?"
+    ],
+    "slm": [
+        "Hello",
+        "Good morning",
+        "Thank you for your help",
+        "Can you help me with a query?",
+        "What are your working hours?",
+        "Can I speak to a human agent?",
+        "How do I update my mobile number?",
+        "What is a savings account?",
+        "What does KYC mean?",
+        "How can I improve my credit score?",
+        "What is the difference between a debit and a credit card?",
+        "How do I register for net banking?",
+        "What services does the bank offer?",
+        "How do I raise a complaint?",
+        "What is a fixed deposit?",
+        "Tell me a joke about loans"
+    ]
+}
+
+router_examples["block"] += [
+    item["instruction"] for item in dataset
+    if item["output"] == categories["Refusal"]["response"]
+]
+router_examples["dataset"] = [
+    item["instruction"] for item in dataset
+    if item["output"] != categories["Refusal"]["response"]
+]
+
+with open("data/router_examples.json", "w") as f:
+    json.dump(router_examples, f, indent=4)
+
+print(f"{sum(len(v) for v in router_examples.values())} router examples generated successfully.")
+
+
 
 
 """
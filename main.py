@@ -1,11 +1,49 @@
-from fastapi import FastAPI
+import asyncio
+import json
+import time
+import weakref
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 
-from services.similarity import search_similar_query
-from services.guardrails import apply_guardrails
-from services.model import generate_slm_response, generate_rag_response
+from services.cache import response_cache, semantic_cache
+from services.embeddings import batcher, encode_query, encode_texts
+from services import similarity
+from services.similarity import search_similar_query, search_similar_queries
+from services.guardrails import apply_guardrails, guardrails
+from services.router import route_many
+from services.startup import startup
+from services.text_utils import normalize_query
+from services.generation import PromptTooLong
+from services.metrics import metrics, server_timing, start_request, timed
+from services.pipeline import (
+    RETRY_AFTER_SECONDS,
+    Overloaded,
+    embedding_stage,
+    search_stage,
+    generation_stage,
+    pipeline_stats,
+)
+from services.model import (
+    generate_slm_response,
+    generate_rag_response,
+    stream_slm_response,
+    stream_rag_response,
+    get_generation_stats,
+    get_scheduler_stats,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load and warm up in the background; /ready reports progress
+    startup.start()
+    yield
 
-app = FastAPI(title="BFSI Call Center AI Assistant")
+
+app = FastAPI(title="BFSI Call Center AI Assistant", lifespan=lifespan)
 
 
 # ---------------------------------------------------
@@ -16,8 +54,12 @@ class QueryRequest(BaseModel):
     query: str
 
 
+class BatchQueryRequest(BaseModel):
+    queries: list[str]
+
+
 # ---------------------------------------------------
-# 🔹 Health Endpoint
+# 🔹 Health Endpoints
 # ---------------------------------------------------
 
 @app.get("/health")
@@ -25,22 +67,155 @@ def health_check():
     return {"status": "running"}
 
 
+@app.get("/live")
+def liveness():
+    """
+    The process is up and serving requests.
+    """
+    return {"status": "alive"}
+
+
+@app.get("/ready")
+def readiness():
+    """
+    200 once every required component is loaded and warmed up, else 503.
+    Either way the body lists each component's state and timings.
+    """
+    status = startup.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+# ---------------------------------------------------
+# 🔹 Stats Endpoint
+# ---------------------------------------------------
+
+@app.get("/stats")
+def stats():
+    return {
+        "generation": get_generation_stats(),
+        "response_cache": response_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "guardrails": guardrails.stats(),
+        "pipeline": pipeline_stats(),
+        "scheduler": get_scheduler_stats(),
+        "tiers": metrics.tier_ratios(),
+    }
+
+
+# ---------------------------------------------------
+# 🔹 Metrics Endpoint (Prometheus text format)
+# ---------------------------------------------------
+
+@app.get("/metrics")
+def metrics_endpoint():
+    stages = pipeline_stats()
+    generation = get_generation_stats()
+    scheduler = get_scheduler_stats()
+
+    queues = [({"queue": f"{name}_stage"}, stage["in_flight"]) for name, stage in stages.items()]
+    queues.append(({"queue": "embedding_batcher"}, batcher.pending()))
+    if scheduler:
+        queues.append(({"queue": "generation_engine"}, scheduler["waiting"]))
+
+    gauges = [
+        ("queue_depth", "Requests waiting or running per queue.", "gauge", queues),
+        ("stage_rejected_total", "Requests rejected by a full stage.", "counter",
+         [({"stage": name}, stage["rejected"]) for name, stage in stages.items()]),
+        ("generation_batch_size", "Rows in the running decode batch.", "gauge",
+         [({}, scheduler["active"])] if scheduler else []),
+        ("generated_tokens_total", "Tokens generated per tier.", "counter",
+         [({"tier": tier}, values["decode_steps"]) for tier, values in generation.items()]),
+        ("request_tokens_per_second", "Decode speed seen by one request, per tier.", "gauge",
+         [({"tier": tier}, values["decode_steps"] / values["decode_seconds"])
+          for tier, values in generation.items() if values["decode_seconds"]]),
+        ("engine_tokens_per_second", "Tokens decoded per second across the batch.", "gauge",
+         [({}, scheduler["tokens_per_second"])] if scheduler else []),
+        ("cache_hit_ratio", "Hit ratio per cache.", "gauge", [
+            ({"cache": "response"}, response_cache.stats()["hit_rate"]),
+            ({"cache": "semantic"}, semantic_cache.stats()["hit_rate"]),
+        ]),
+    ]
+
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+
 # ---------------------------------------------------
 # 🔹 Helper: Detect complex financial queries
 # ---------------------------------------------------
 
 def is_complex_query(query: str) -> bool:
-    complex_keywords = [
-        "calculate",
-        "breakdown",
-        "formula",
-        "penalty",
-        "clause",
-        "amortization",
-        "foreclosure",
-        "interest calculation"
-    ]
-    return any(word in query.lower() for word in complex_keywords)
+    # Keywords live in the "complex" rule set of the guardrail config
+    return guardrails.match("complex", query) is not None
+
+
+# ---------------------------------------------------
+# 🔹 Helper: Route a query from its embedding
+# ---------------------------------------------------
+# Routing runs on the search stage, off the event loop. The router is a
+# required startup component, so it is loaded (or trained) before /ready
+# reports ready; an earlier request loads it in a stage thread.
+
+
+def route_query(query: str, query_embedding) -> str:
+    """
+    "block", "rag" or "slm" from the embedding router.
+    Falls back to the keyword rules when no router is loaded, and for
+    FAQ-like queries the dataset tier missed (complex ones go to RAG,
+    the rest to the SLM, as before the router).
+    """
+
+    return route_queries([query], query_embedding)[0]
+
+
+def route_queries(queries, query_embeddings) -> list:
+    """
+    route_query for a batch, with one router pass over all embeddings.
+    """
+
+    with timed("router"):
+        routes = route_many(query_embeddings)
+
+    decisions = []
+    for query, (decision, _) in zip(queries, routes):
+        if decision in (None, "dataset"):
+            decision = "rag" if is_complex_query(query) else "slm"
+        decisions.append(decision)
+    return decisions
+
+
+# ---------------------------------------------------
+# 🔹 Helper: Overload responses
+# ---------------------------------------------------
+
+BUSY_MESSAGE = "The assistant is busy right now. Please try again shortly."
+TOO_LONG_MESSAGE = "Query is too long. Please shorten it and try again."
+GENERATION_FAILED_MESSAGE = "Generation failed"
+
+# A generation overload serves the closest dataset answer when it is
+# within this margin of the match threshold
+DEGRADED_MARGIN = 0.1
+
+
+def _overloaded(exc: Overloaded) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        content={"response": BUSY_MESSAGE, "tier": "overloaded", "stage": exc.stage},
+    )
+
+
+async def _degraded(query: str, query_embedding):
+    """
+    Cheaper answer when the generation stage is full, or None.
+    """
+
+    threshold = similarity.match_threshold - DEGRADED_MARGIN
+    result, score = await search_stage.run(
+        search_similar_query, query, threshold=threshold, query_embedding=query_embedding
+    )
+    if result:
+        return {"response": result, "tier": "degraded", "similarity_score": round(score, 3)}
+    return None
 
 
 # ---------------------------------------------------
@@ -48,32 +223,400 @@ def is_complex_query(query: str) -> bool:
 # ---------------------------------------------------
 
 @app.post("/query")
-def handle_query(payload: QueryRequest):
+async def handle_query(payload: QueryRequest, response: Response, timings: bool = False):
+    """
+    Answer one query. The time spent per stage is sent in a
+    Server-Timing header, and in the body as "timings" (milliseconds)
+    when ?timings=true.
+    """
 
-    query = payload.query.strip()
+    started = time.perf_counter()
+    breakdown = start_request()
+
+    result = await _answer_query(payload.query.strip())
+
+    seconds = time.perf_counter() - started
+    tier = result["tier"] if isinstance(result, dict) else "overloaded"
+    metrics.observe_request(tier, seconds, breakdown)
+
+    breakdown["total"] = seconds * 1000
+    headers = result.headers if isinstance(result, Response) else response.headers
+    headers["Server-Timing"] = server_timing(breakdown)
+
+    if timings and isinstance(result, dict):
+        result = {**result, "timings": {stage: round(ms, 3) for stage, ms in breakdown.items()}}
+    return result
+
+
+async def _answer_query(query: str):
+    """
+    Final result dict, or a 503 response when the pipeline is full.
+    """
 
     if not query:
         return {"response": "Query cannot be empty.", "tier": "error"}
 
-    # Tier 0: Guardrails
-    blocked, message = apply_guardrails(query)
+    try:
+        result, query_embedding, tier = await _answer_before_generation(query)
+        if result is not None:
+            return result
+
+        try:
+            response = await generation_stage.run(_generate, query, query_embedding, tier)
+        except Overloaded as exc:
+            result = await _degraded(query, query_embedding)
+            return result if result is not None else _overloaded(exc)
+        except PromptTooLong:
+            return {"response": TOO_LONG_MESSAGE, "tier": "error"}
+
+    except Overloaded as exc:
+        return _overloaded(exc)
+
+    result = {"response": response, "tier": tier}
+    response_cache.put(query, result)
+    semantic_cache.store(query_embedding, result)
+    return result
+
+
+async def _answer_before_generation(query: str):
+    """
+    Every tier in front of generation, on the bounded stages.
+
+    Returns:
+        (result: dict or None, query_embedding, tier: str)
+        result is the final answer when a tier produced one; otherwise
+        tier names the generation tier ("rag" or "slm") to run.
+    """
+
+    # Tier 0: Guardrails (always evaluated on the raw query, never cached)
+    with timed("guardrails"):
+        blocked, message, rule = apply_guardrails(query)
     if blocked:
-        return {"response": message, "tier": "guardrail"}
+        return {"response": message, "tier": "guardrail", "rule": rule}, None, "guardrail"
+
+    # Repeat questions skip every model tier
+    with timed("response_cache"):
+        cached = response_cache.get(query)
+    if cached:
+        cached["cached"] = True
+        return cached, None, cached["tier"]
+
+    # Encode once and share the vector across all tiers
+    query_embedding = await embedding_stage.run(encode_query, query)
+
+    # Paraphrased sensitive requests the keyword rules missed
+    tier = await search_stage.run(route_query, query, query_embedding)
+    if tier == "block":
+        result = {"response": guardrails.refusal_message, "tier": "guardrail", "rule": "semantic"}
+        return result, query_embedding, "guardrail"
 
     # Tier 1: Dataset Similarity
-    result, score = search_similar_query(query)
+    result, score = await search_stage.run(search_similar_query, query, query_embedding=query_embedding)
     if result:
-        return {
+        result = {
             "response": result,
             "tier": "dataset",
             "similarity_score": round(score, 3)
         }
+        response_cache.put(query, result)
+        return result, query_embedding, "dataset"
+
+    # Paraphrases of recently generated answers
+    cached = await search_stage.run(semantic_cache.lookup, query_embedding, tier)
+    if cached:
+        cached["cached"] = True
+        return cached, query_embedding, tier
+
+    return None, query_embedding, tier
 
+
+def _generate(query: str, query_embedding, tier: str) -> str:
     # Tier 3: RAG
-    if is_complex_query(query):
-        response = generate_rag_response(query)
-        return {"response": response, "tier": "rag"}
+    if tier == "rag":
+        return generate_rag_response(query, query_embedding=query_embedding)
 
     # Tier 2: SLM fallback
-    response = generate_slm_response(query)
-    return {"response": response, "tier": "slm"}
+    return generate_slm_response(query)
+
+
+# ---------------------------------------------------
+# 🔹 Streaming Query Endpoint (Server-Sent Events)
+# ---------------------------------------------------
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _single_event(result: dict):
+    yield _sse("done", result)
+
+
+async def _stream_events(query: str, query_embedding, tier: str, slot, breakdown: dict, started: float):
+    """
+    Stream a generated answer on a generation slot reserved by the
+    caller; the slot is released when the stream ends or the client
+    disconnects.
+    Emits "token" events as text is produced, then one "done" event
+    holding the final response.
+    """
+
+    # Generation time lands in the request's breakdown
+    start_request(breakdown)
+
+    # Tier 3: RAG / Tier 2: SLM fallback
+    if tier == "rag":
+        events = stream_rag_response(query, query_embedding=query_embedding)
+    else:
+        events = stream_slm_response(query)
+
+    try:
+        while True:
+            event = await asyncio.to_thread(next, events, None)
+            if event is None:
+                break
+
+            kind, text = event
+            if kind == "token":
+                yield _sse("token", {"text": text})
+            else:
+                result = {"response": text, "tier": tier}
+                response_cache.put(query, result)
+                semantic_cache.store(query_embedding, result)
+                metrics.observe_request(tier, time.perf_counter() - started, breakdown)
+                yield _sse("done", result)
+    except PromptTooLong:
+        metrics.observe_request("error", time.perf_counter() - started, breakdown)
+        yield _sse("done", {"response": TOO_LONG_MESSAGE, "tier": "error"})
+    finally:
+        try:
+            # Cancels the generation request
+            events.close()
+        except ValueError:
+            # Still running in a worker thread; it is closed when collected
+            pass
+        slot.release()
+
+
+@app.post("/query/stream")
+async def handle_query_stream(payload: QueryRequest):
+    """
+    Same tier flow as handle_query.
+    Overload is reported with a 503 before the stream starts.
+    """
+
+    query = payload.query.strip()
+
+    if not query:
+        return StreamingResponse(
+            _single_event({"response": "Query cannot be empty.", "tier": "error"}),
+            media_type="text/event-stream"
+        )
+
+    started = time.perf_counter()
+    breakdown = start_request()
+
+    try:
+        result, query_embedding, tier = await _answer_before_generation(query)
+
+        if result is None:
+            try:
+                slot = generation_stage.hold()
+            except Overloaded as exc:
+                result = await _degraded(query, query_embedding)
+                if result is None:
+                    # Recorded and answered with a 503 below
+                    raise
+
+    except Overloaded as exc:
+        metrics.observe_request("overloaded", time.perf_counter() - started, breakdown)
+        return _overloaded(exc)
+
+    if result is not None:
+        metrics.observe_request(result["tier"], time.perf_counter() - started, breakdown)
+        events = _single_event(result)
+    else:
+        events = _stream_events(query, query_embedding, tier, slot, breakdown, started)
+        # A stream dropped before it starts never runs its finally block
+        weakref.finalize(events, slot.release)
+
+    return StreamingResponse(events, media_type="text/event-stream")
+
+
+# ---------------------------------------------------
+# 🔹 Batch Query Endpoint (JSON Lines)
+# ---------------------------------------------------
+
+MAX_BATCH_QUERIES = 1000
+
+
+async def answer_batch_before_generation(queries):
+    """
+    The tiers in front of generation for a whole batch: guardrails and
+    the response cache per query, then one encode, one router pass,
+    one dataset search and one semantic cache search over every query
+    still unanswered.
+
+    Returns:
+        (results, query_embeddings, tiers), lists in input order.
+        results[i] is None when query i still needs generation by
+        tiers[i]; query_embeddings[i] is its (1, dim) vector.
+    """
+
+    queries = [query.strip() for query in queries]
+    results = [None] * len(queries)
+    query_embeddings = [None] * len(queries)
+    tiers = [None] * len(queries)
+
+    # Tier 0: Guardrails over the whole batch before any model work
+    pending = []
+    for i, query in enumerate(queries):
+        if not query:
+            results[i] = {"response": "Query cannot be empty.", "tier": "error"}
+            continue
+
+        blocked, message, rule = apply_guardrails(query)
+        if blocked:
+            results[i] = {"response": message, "tier": "guardrail", "rule": rule}
+            continue
+
+        cached = response_cache.get(query)
+        if cached:
+            cached["cached"] = True
+            results[i] = cached
+            continue
+
+        pending.append(i)
+
+    if not pending:
+        return results, query_embeddings, tiers
+
+    # One forward pass for every query that reaches the model tiers
+    embeddings = await embedding_stage.run(encode_texts, [queries[i] for i in pending])
+    decisions = await search_stage.run(route_queries, [queries[i] for i in pending], embeddings)
+
+    # Tier 1: Dataset Similarity, one (N, dim) search
+    matches = await search_stage.run(search_similar_queries, embeddings)
+
+    unanswered = []
+    for row, i in enumerate(pending):
+        query_embeddings[i] = embeddings[row:row + 1]
+        tiers[i] = decisions[row]
+        result, score = matches[row]
+
+        if tiers[i] == "block":
+            results[i] = {"response": guardrails.refusal_message, "tier": "guardrail", "rule": "semantic"}
+        elif result:
+            results[i] = {"response": result, "tier": "dataset", "similarity_score": round(score, 3)}
+            response_cache.put(queries[i], results[i])
+        else:
+            unanswered.append(row)
+
+    # Paraphrases of recently generated answers
+    if unanswered:
+        cached = await search_stage.run(
+            semantic_cache.lookup_many,
+            embeddings[unanswered],
+            [tiers[pending[row]] for row in unanswered],
+        )
+        for row, result in zip(unanswered, cached):
+            if result:
+                result["cached"] = True
+                results[pending[row]] = result
+
+    return results, query_embeddings, tiers
+
+
+async def _generate_batch_item(query: str, query_embedding, tier: str, limit: asyncio.Semaphore) -> dict:
+    async with limit:
+        try:
+            response = await generation_stage.run(_generate, query, query_embedding, tier)
+        except Overloaded as exc:
+            result = await _degraded(query, query_embedding)
+            return result if result is not None else {"response": BUSY_MESSAGE, "tier": "overloaded", "stage": exc.stage}
+        except PromptTooLong:
+            return {"response": TOO_LONG_MESSAGE, "tier": "error"}
+        except Exception as exc:
+            # One failed item must not end the stream for the others.
+            # The detail stays in the server log, never in the response.
+            print(f"⚠️ Batch item generation failed: {type(exc).__name__}: {exc}")
+            return {"tier": "error", "error": GENERATION_FAILED_MESSAGE}
+
+    result = {"response": response, "tier": tier}
+    response_cache.put(query, result)
+    semantic_cache.store(query_embedding, result)
+    return result
+
+
+async def answer_batch(queries, results, query_embeddings, tiers):
+    """
+    Final results in input order, as soon as each one and every result
+    before it is available.
+
+    Misses are generated concurrently, up to one generation stage's
+    worth of workers at a time, so the engine decodes them as a batch.
+    """
+
+    limit = asyncio.Semaphore(generation_stage.workers)
+
+    # Repeats within the batch share one generation
+    tasks = []
+    shared = {}
+    for i, query in enumerate(queries):
+        if results[i] is not None:
+            tasks.append(None)
+            continue
+
+        key = (normalize_query(query), tiers[i])
+        if key not in shared:
+            shared[key] = asyncio.create_task(
+                _generate_batch_item(query.strip(), query_embeddings[i], tiers[i], limit)
+            )
+        tasks.append(shared[key])
+
+    try:
+        for i, task in enumerate(tasks):
+            yield i, (dict(await task) if task is not None else results[i])
+    finally:
+        for task in shared.values():
+            task.cancel()
+
+
+async def _batch_lines(queries, results, query_embeddings, tiers, breakdown: dict, started: float):
+    start_request(breakdown)
+
+    async for i, result in answer_batch(queries, results, query_embeddings, tiers):
+        metrics.count_answer(result["tier"])
+        yield json.dumps({"index": i, **result}) + "\n"
+
+    # Stage times are summed over the batch; answers were counted per item
+    metrics.observe_request("batch", time.perf_counter() - started, breakdown, count=False)
+
+
+@app.post("/query/batch")
+async def handle_query_batch(payload: BatchQueryRequest):
+    """
+    Answer many queries in one request.
+    Streams one JSON object per line, in input order, each holding the
+    query's index, response and tier (plus similarity_score or rule
+    where a tier sets one). An item whose generation failed gets an
+    "error" instead of a response.
+    """
+
+    if len(payload.queries) > MAX_BATCH_QUERIES:
+        return JSONResponse(
+            status_code=413,
+            content={"response": f"At most {MAX_BATCH_QUERIES} queries per batch.", "tier": "error"},
+        )
+
+    started = time.perf_counter()
+    breakdown = start_request()
+
+    try:
+        results, query_embeddings, tiers = await answer_batch_before_generation(payload.queries)
+    except Overloaded as exc:
+        return _overloaded(exc)
+
+    return StreamingResponse(
+        _batch_lines(payload.queries, results, query_embeddings, tiers, breakdown, started),
+        media_type="application/x-ndjson"
+    )
@@ -0,0 +1,120 @@
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+# Tokenizer thread pools must not be started before fork()
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+import faiss
+import torch
+import uvicorn
+
+# Pre-fork server: the parent loads models, indexes and the dataset once,
+# then forks workers that share those pages copy-on-write. Each worker
+# gets its own slice of the CPU cores for torch and FAISS.
+#
+# Build indexes first (python build_indexes.py) so the parent only loads
+# them; rebuilding here would start torch thread pools before the fork.
+
+parser = argparse.ArgumentParser(description="Serve the API from pre-forked worker processes.")
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", type=int, default=8000)
+parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+parser.add_argument("--threads", type=int, help="torch threads per worker (default: cores / workers)")
+args = parser.parse_args()
+
+threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+
+
+# ---------------------------------------------------
+# 🔹 Load Once in the Parent
+# ---------------------------------------------------
+
+started = time.perf_counter()
+import main  # noqa: E402
+from services.startup import startup  # noqa: E402
+
+# Load only: warm-up runs in each worker on app startup, so no torch
+# or batching threads are started here before the fork
+startup.load()
+print(f"✅ Models and indexes loaded in {time.perf_counter() - started:.1f}s.")
+
+# Move everything loaded so far out of the collector's reach, so GC
+# passes in the workers do not write to (and un-share) those pages
+gc.collect()
+gc.freeze()
+
+sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+sock.bind((args.host, args.port))
+sock.listen(2048)
+sock.set_inheritable(True)
+
+
+# ---------------------------------------------------
+# 🔹 Workers
+# ---------------------------------------------------
+
+def run_worker():
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    torch.set_num_threads(threads)
+    faiss.omp_set_num_threads(threads)
+
+    config = uvicorn.Config(main.app, log_level="info")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn_worker() -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker()
+        finally:
+            os._exit(0)
+    return pid
+
+
+# ---------------------------------------------------
+# 🔹 Supervisor
+# ---------------------------------------------------
+
+workers = set()
+stopping = False
+
+
+def stop(signum, frame):
+    global stopping
+    stopping = True
+    for pid in workers:
+        os.kill(pid, signal.SIGTERM)
+
+
+signal.signal(signal.SIGINT, stop)
+signal.signal(signal.SIGTERM, stop)
+
+for _ in range(args.workers):
+    workers.add(spawn_worker())
+
+print(f"✅ Serving on http://{args.host}:{args.port} with {args.workers} workers x {threads} threads.")
+
+# Replace workers that die; exit once all have stopped after a signal
+while workers:
+    try:
+        pid, status = os.wait()
+    except ChildProcessError:
+        break
+    except InterruptedError:
+        continue
+
+    workers.discard(pid)
+    if not stopping:
+        print(f"⚠️ Worker {pid} exited ({status}); restarting.")
+        workers.add(spawn_worker())
+
+sys.exit(0)
@@ -0,0 +1,293 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+from services.embeddings import SIMILARITY_MODE, new_flat_index, to_similarity
+from services.metrics import timed
+from services.model import MODEL_PATH
+from services.rag import CURRENT_PATH, KNOWLEDGE_DIR
+from services.similarity import DATASET_STORE_PATH
+from services.text_utils import normalize_query
+
+# ---------------------------------------------------
+# 🔹 Configuration
+# ---------------------------------------------------
+
+MAX_ENTRIES = 10000
+
+# Seconds a cached answer stays valid, per producing tier.
+# Tiers not listed here are never cached.
+TIER_TTLS = {
+    "dataset": 3600,
+    "rag": 900,
+    "slm": 900,
+}
+
+# Semantic cache of generated (RAG / SLM) answers
+SEMANTIC_MAX_ENTRIES = 5000
+SEMANTIC_THRESHOLDS = {"cosine": 0.91, "l2": 0.85}   # per SIMILARITY_MODE
+
+# Both caches are dropped when any of these change on disk: knowledge
+# docs, the active RAG version, the SLM and the compiled dataset
+WATCH_PATHS = [KNOWLEDGE_DIR, CURRENT_PATH, MODEL_PATH, DATASET_STORE_PATH]
+CHECK_INTERVAL = 30   # seconds between fingerprint checks
+
+
+# ---------------------------------------------------
+# 🔹 Source Change Detection
+# ---------------------------------------------------
+
+def _fingerprint(paths) -> tuple:
+    """
+    Cheap change detector: (path, size, mtime) of every watched file.
+    """
+
+    entries = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    entries.append(os.path.join(root, name))
+        elif os.path.exists(path):
+            entries.append(path)
+
+    fingerprint = []
+    for entry in sorted(entries):
+        stat = os.stat(entry)
+        fingerprint.append((entry, stat.st_size, stat.st_mtime_ns))
+    return tuple(fingerprint)
+
+
+class SourceWatch:
+    """
+    Reports whether the watched paths changed since the last check,
+    looking at most once per check_interval.
+    """
+
+    def __init__(self, paths, check_interval: float = CHECK_INTERVAL):
+        self.paths = list(paths)
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._fingerprint = _fingerprint(self.paths)
+        self._checked_at = time.monotonic()
+
+    def changed(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return False
+            self._checked_at = now
+
+        fingerprint = _fingerprint(self.paths)
+        with self._lock:
+            if fingerprint == self._fingerprint:
+                return False
+            self._fingerprint = fingerprint
+            return True
+
+
+# ---------------------------------------------------
+# 🔹 Response Cache (LRU + per-tier TTL)
+# ---------------------------------------------------
+
+class ResponseCache:
+    """
+    Bounded LRU cache of final responses keyed on the normalized query.
+    Each entry remembers the tier that produced it and expires after
+    that tier's TTL. Everything is dropped when a watched source
+    changes on disk.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, tier_ttls: dict = None,
+                 watch_paths=None, check_interval: float = CHECK_INTERVAL):
+        self.max_entries = max_entries
+        self.tier_ttls = dict(TIER_TTLS if tier_ttls is None else tier_ttls)
+        self.sources = SourceWatch(WATCH_PATHS if watch_paths is None else watch_paths, check_interval)
+
+        self._entries = OrderedDict()   # key -> (expires_at, response)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._hits_by_tier = {}
+        self._invalidations = 0
+
+    def get(self, query: str):
+        if self.sources.changed():
+            self.clear()
+            with self._lock:
+                self._invalidations += 1
+
+        key = normalize_query(query)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+
+            if entry is None:
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            response = entry[1]
+            self._hits += 1
+            self._hits_by_tier[response["tier"]] = self._hits_by_tier.get(response["tier"], 0) + 1
+
+        return dict(response)
+
+    def put(self, query: str, response: dict):
+        ttl = self.tier_ttls.get(response.get("tier"))
+        if not ttl:
+            return
+
+        key = normalize_query(query)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, dict(response))
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "hits_by_tier": dict(self._hits_by_tier),
+                "invalidations": self._invalidations,
+            }
+
+
+response_cache = ResponseCache()
+
+
+# ---------------------------------------------------
+# 🔹 Semantic Answer Cache (embedding neighbourhood)
+# ---------------------------------------------------
+
+class SemanticCache:
+    """
+    Generated answers indexed by their query embedding.
+
+    A later query whose embedding falls within the similarity threshold
+    of a cached one (for the same tier) reuses its answer. Entries are
+    evicted oldest-first beyond max_entries, and the whole cache is
+    dropped when a watched source changes on disk.
+    """
+
+    def __init__(self, max_entries: int = SEMANTIC_MAX_ENTRIES, threshold: float = None,
+                 watch_paths=None, check_interval: float = CHECK_INTERVAL):
+        self.max_entries = max_entries
+        self.threshold = SEMANTIC_THRESHOLDS[SIMILARITY_MODE] if threshold is None else threshold
+        self.sources = SourceWatch(WATCH_PATHS if watch_paths is None else watch_paths, check_interval)
+
+        self._lock = threading.Lock()
+        self._index = None
+        self._entries = OrderedDict()   # id -> (tier, response)
+        self._next_id = 0
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def lookup(self, query_embedding, tier: str):
+        return self.lookup_many(query_embedding, [tier])[0]
+
+    def lookup_many(self, query_embeddings, tiers):
+        """
+        Cached answers for an (N, dim) matrix of query embeddings in one
+        search; tiers[i] is the tier row i would be generated by.
+
+        Returns:
+            [response dict or None] in row order
+        """
+
+        with timed("semantic_cache"):
+            return self._lookup_many(query_embeddings, tiers)
+
+    def _lookup_many(self, query_embeddings, tiers):
+        if self.sources.changed():
+            self.invalidate()
+
+        with self._lock:
+            if self._index is None or self._index.ntotal == 0:
+                self._misses += len(tiers)
+                return [None] * len(tiers)
+
+            k = min(self._index.ntotal, 4)
+            distances, ids = self._index.search(np.asarray(query_embeddings, dtype="float32"), k)
+
+            results = [self._match(distances[row], ids[row], tier) for row, tier in enumerate(tiers)]
+
+            hits = sum(result is not None for result in results)
+            self._hits += hits
+            self._misses += len(results) - hits
+            return results
+
+    def _match(self, distances, ids, tier: str):
+        for distance, entry_id in zip(distances, ids):
+            if entry_id < 0:
+                continue
+
+            score = to_similarity(distance)
+            if score < self.threshold:
+                break
+
+            entry_tier, response = self._entries[int(entry_id)]
+            if entry_tier == tier:
+                return dict(response)
+
+        return None
+
+    def store(self, query_embedding, response: dict):
+        vector = np.asarray(query_embedding, dtype="float32").reshape(1, -1)
+
+        with self._lock:
+            if self._index is None:
+                self._index = faiss.IndexIDMap(new_flat_index(vector.shape[1]))
+
+            entry_id = self._next_id
+            self._next_id += 1
+
+            self._index.add_with_ids(vector, np.array([entry_id], dtype="int64"))
+            self._entries[entry_id] = (response["tier"], dict(response))
+
+            if len(self._entries) > self.max_entries:
+                evicted = []
+                while len(self._entries) > self.max_entries:
+                    evicted.append(self._entries.popitem(last=False)[0])
+                self._index.remove_ids(np.array(evicted, dtype="int64"))
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+            self._entries.clear()
+            self._invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self._invalidations,
+            }
+
+
+semantic_cache = SemanticCache()
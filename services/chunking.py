@@ -0,0 +1,128 @@
+import re
+
+# ---------------------------------------------------
+# 🔹 Configuration
+# ---------------------------------------------------
+
+CHUNK_TOKENS = 128           # embedding-model tokens per chunk
+CHUNK_OVERLAP_TOKENS = 24    # trailing sentences repeated in the next chunk
+
+# Sentence ends at . ! or ? followed by whitespace, or at a line break
+SENTENCE_PATTERN = re.compile(r"[^\n]+?(?:[.!?](?=\s)|$)", re.MULTILINE)
+
+
+# ---------------------------------------------------
+# 🔹 Sentence Splitting
+# ---------------------------------------------------
+
+def _sentences(text: str):
+    """
+    (start, end) offsets of the sentences in one paragraph.
+    """
+
+    for match in SENTENCE_PATTERN.finditer(text):
+        start = match.start() + len(match.group()) - len(match.group().lstrip())
+        if start < match.end():
+            yield start, match.end()
+
+
+def _paragraphs(lines):
+    """
+    Stream (offset, text) paragraphs from an iterable of lines.
+    Blank lines separate paragraphs; offsets are character positions.
+    """
+
+    offset = 0
+    start = None
+    buffer = []
+
+    for line in lines:
+        if line.strip():
+            if start is None:
+                start = offset
+            buffer.append(line)
+        elif buffer:
+            yield start, "".join(buffer)
+            start, buffer = None, []
+        offset += len(line)
+
+    if buffer:
+        yield start, "".join(buffer)
+
+
+# ---------------------------------------------------
+# 🔹 Chunker
+# ---------------------------------------------------
+
+def _split_long_sentence(text: str, start: int, end: int, count_tokens, max_tokens: int):
+    """
+    Cut a sentence longer than the budget at word boundaries.
+    """
+
+    piece_start = start
+    piece_end = start
+    for word in re.finditer(r"\S+", text[start:end]):
+        word_end = start + word.end()
+        if piece_end > piece_start and count_tokens(text[piece_start:word_end]) > max_tokens:
+            yield piece_start, piece_end
+            piece_start = start + word.start()
+        piece_end = word_end
+
+    if piece_end > piece_start:
+        yield piece_start, piece_end
+
+
+def chunk_file(path: str, source: str, count_tokens,
+               max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+    """
+    Stream one document as chunks of whole sentences under max_tokens.
+
+    The file is read paragraph by paragraph. Chunks never cross a
+    blank-line paragraph boundary; within a long paragraph consecutive
+    chunks repeat up to overlap_tokens of trailing sentences. Each chunk
+    keeps its source and character offsets in the file.
+    """
+
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for offset, paragraph in _paragraphs(f):
+            yield from _chunk_paragraph(paragraph, offset, source, count_tokens, max_tokens, overlap_tokens)
+
+
+def _chunk_paragraph(paragraph, offset, source, count_tokens, max_tokens, overlap_tokens):
+    spans = []
+    for start, end in _sentences(paragraph):
+        if count_tokens(paragraph[start:end]) > max_tokens:
+            spans.extend(_split_long_sentence(paragraph, start, end, count_tokens, max_tokens))
+        else:
+            spans.append((start, end))
+
+    window = []
+    for span in spans:
+        if window and count_tokens(paragraph[window[0][0]:span[1]]) > max_tokens:
+            yield _chunk(paragraph, window, offset, source)
+
+            # Carry trailing sentences into the next chunk as overlap
+            carried = []
+            for previous in reversed(window):
+                candidate = [previous] + carried
+                if count_tokens(paragraph[candidate[0][0]:candidate[-1][1]]) > overlap_tokens:
+                    break
+                if count_tokens(paragraph[candidate[0][0]:span[1]]) > max_tokens:
+                    break
+                carried = candidate
+            window = carried
+
+        window.append(span)
+
+    if window:
+        yield _chunk(paragraph, window, offset, source)
+
+
+def _chunk(paragraph, window, offset, source):
+    start, end = window[0][0], window[-1][1]
+    return {
+        "text": paragraph[start:end],
+        "source": source,
+        "start": offset + start,
+        "end": offset + end,
+    }
@@ -0,0 +1,252 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import faiss
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from services.loading import check_materialized, model_load_lock
+from services.metrics import timed
+from services.quantization import quantize_int8
+
+# ---------------------------------------------------
+# 🔹 Configuration
+# ---------------------------------------------------
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# "cosine": unit-normalized embeddings searched by inner product
+# "l2": raw embeddings searched by L2 distance, scored as 1/(1+d)
+SIMILARITY_MODE = "cosine"
+
+# "fp32" or "int8" (dynamic quantization of the encoder's linear layers).
+# Indexes stay compatible; check_quantization.py measures the drift.
+EMBEDDING_BACKEND = "fp32"
+
+# Micro-batching of concurrent query encodes
+MAX_BATCH_SIZE = 16
+MAX_WAIT_MS = 8
+
+
+# ---------------------------------------------------
+# 🔹 Load Embedding Model Once (shared by all tiers, on first use)
+# ---------------------------------------------------
+
+def load_embedding_model(backend: str = EMBEDDING_BACKEND):
+    with model_load_lock:
+        encoder = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    check_materialized(encoder, "Embedding")
+    encoder.eval()
+
+    if backend == "int8":
+        encoder = quantize_int8(encoder)
+    elif backend != "fp32":
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    return encoder
+
+
+embedding_model = None
+_load_lock = threading.Lock()
+
+
+def load_embedding():
+    """
+    Load the shared encoder once; later calls return it immediately.
+    """
+
+    global embedding_model
+
+    if embedding_model is None:
+        with _load_lock:
+            if embedding_model is None:
+                embedding_model = load_embedding_model()
+
+    return embedding_model
+
+
+# ---------------------------------------------------
+# 🔹 Encoding Helpers
+# ---------------------------------------------------
+
+def count_tokens(text: str) -> int:
+    """
+    Number of embedding-model tokens in a text (no special tokens).
+    """
+
+    return len(load_embedding().tokenizer(text, add_special_tokens=False)["input_ids"])
+
+
+def encode_texts(texts, encoder=None) -> np.ndarray:
+    """
+    Encode a list of texts into a float32 (N, dim) matrix.
+    Rows are unit-normalized in cosine mode.
+    Uses the shared model unless another encoder is given.
+    """
+
+    encoder = encoder or load_embedding()
+    with timed("embedding"):
+        embeddings = encoder.encode(texts, normalize_embeddings=SIMILARITY_MODE == "cosine")
+    return np.asarray(embeddings, dtype="float32")
+
+
+# ---------------------------------------------------
+# 🔹 Similarity Helpers (shared by every FAISS index)
+# ---------------------------------------------------
+
+def index_metric() -> int:
+    """
+    FAISS metric matching SIMILARITY_MODE.
+    """
+
+    if SIMILARITY_MODE == "cosine":
+        return faiss.METRIC_INNER_PRODUCT
+    return faiss.METRIC_L2
+
+
+def new_flat_index(dimension: int):
+    """
+    Exact FAISS index for SIMILARITY_MODE.
+    """
+
+    if SIMILARITY_MODE == "cosine":
+        return faiss.IndexFlatIP(dimension)
+    return faiss.IndexFlatL2(dimension)
+
+
+# Memory-map index vectors so worker processes share the same pages
+_MMAP_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+
+def read_shared_index(path: str):
+    """
+    Read-only FAISS index backed by the file's page cache.
+    """
+
+    return faiss.read_index(path, _MMAP_FLAG)
+
+
+def to_similarity(distances):
+    """
+    Convert FAISS search output into similarity scores (higher is closer).
+    Inner products of unit vectors already are cosine similarities.
+    """
+
+    distances = np.asarray(distances, dtype="float32")
+    if SIMILARITY_MODE == "cosine":
+        return distances
+    return 1 / (1 + distances)
+
+
+# ---------------------------------------------------
+# 🔹 Micro-Batching Queue
+# ---------------------------------------------------
+
+class EmbeddingBatcher:
+    """
+    Gathers concurrent single-query encodes into one forward pass.
+
+    The worker takes whatever is already queued. It only waits up to
+    max_wait_ms for more callers when the previous batch had company,
+    so an idle server encodes a lone query immediately.
+    """
+
+    def __init__(self, max_batch_size: int = MAX_BATCH_SIZE, max_wait_ms: float = MAX_WAIT_MS):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._last_batch_size = 0
+
+        # Threads do not survive fork(); pre-forked workers start their own
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((text, future))
+        return future
+
+    def encode(self, text: str) -> np.ndarray:
+        return self.submit(text).result()
+
+    def pending(self) -> int:
+        """
+        Queries waiting for the next encode.
+        """
+
+        return self._queue.qsize()
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="embedding-batcher", daemon=True
+                )
+                self._worker.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+
+        deadline = None
+        if self._last_batch_size > 1:
+            deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+
+            if deadline is None:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        self._last_batch_size = len(batch)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for text, _ in batch]
+
+            try:
+                vectors = encode_texts(texts)
+            except Exception as exc:
+                for _, future in batch:
+                    future.set_exception(exc)
+                continue
+
+            for i, (_, future) in enumerate(batch):
+                future.set_result(vectors[i:i + 1])
+
+
+batcher = EmbeddingBatcher()
+
+
+def encode_query(query: str) -> np.ndarray:
+    """
+    Encode a single query into a float32 (1, dim) vector.
+    Computed once per request and passed to every tier.
+    Concurrent callers are batched into one encode.
+    """
+
+    with timed("embedding"):
+        return batcher.encode(query)
@@ -0,0 +1,629 @@
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future
+
+import torch
+import torch.nn.functional as F
+from transformers import DynamicCache
+
+from services.metrics import current_timings, record
+
+# ---------------------------------------------------
+# 🔹 Configuration
+# ---------------------------------------------------
+
+MAX_BATCH_SIZE = 8
+REPETITION_PENALTY = 1.2
+
+# Tokens decoded when looking for a stop sequence at the end of a row
+STOP_SEQUENCE_WINDOW = 16
+
+# Prompt prefixes whose key/values are kept for reuse
+MAX_CACHED_PREFIXES = 8
+
+
+class PromptTooLong(ValueError):
+    """
+    Raised for a prompt with no room left for generated tokens.
+    """
+
+
+# ---------------------------------------------------
+# 🔹 KV-Cache Helpers
+# ---------------------------------------------------
+
+def _to_cache(past):
+    """
+    Wrap per-layer (key, value) tensors in a transformers cache object.
+    """
+
+    if past is None:
+        return DynamicCache()
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(tuple(past))
+    return DynamicCache(past)
+
+
+def _from_cache(cache):
+    """
+    Unwrap a transformers cache object into per-layer (key, value) tensors.
+    """
+
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return [(k, v) for k, v in cache.to_legacy_cache()]
+
+
+def _left_pad(tensor, length: int, dim: int):
+    """
+    Left-pad a tensor with zeros along dim up to the given length.
+    """
+
+    missing = length - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    pad = [0, 0] * (tensor.dim() - 1 - dim) + [missing, 0]
+    return F.pad(tensor, pad)
+
+
+# ---------------------------------------------------
+# 🔹 Stopping Criteria
+# ---------------------------------------------------
+
+class StopCriteria:
+    """
+    Token-id stopping rules applied to every request.
+
+    Each vocabulary piece is classified once at start-up, so the
+    per-token check is a set lookup. A row ends on the token that
+    completes one of the stop sequences or, with first_paragraph, on
+    the first newline after non-blank text.
+    """
+
+    def __init__(self, tokenizer, stop_sequences=(), first_paragraph: bool = False):
+        self.tokenizer = tokenizer
+        self.stop_sequences = list(stop_sequences)
+        self.first_paragraph = first_paragraph
+
+        self.content_ids = set()
+        self.newline_ids = set()
+        self.leading_content_ids = set()   # non-blank text before the newline
+        self.sequence_end_ids = set()      # may complete a stop sequence
+
+        end_chars = {sequence[-1] for sequence in self.stop_sequences}
+        pieces = tokenizer.batch_decode([[i] for i in range(len(tokenizer))])
+
+        for token_id, piece in enumerate(pieces):
+            if piece.strip():
+                self.content_ids.add(token_id)
+            if "\n" in piece:
+                self.newline_ids.add(token_id)
+                if piece.split("\n")[0].strip():
+                    self.leading_content_ids.add(token_id)
+            if any(char in piece for char in end_chars):
+                self.sequence_end_ids.add(token_id)
+
+    def __call__(self, request, token: int) -> bool:
+        if self.first_paragraph and token in self.newline_ids:
+            if request.has_content or token in self.leading_content_ids:
+                return True
+
+        if token in self.content_ids:
+            request.has_content = True
+
+        if token in self.sequence_end_ids:
+            tail = self.tokenizer.decode(request.token_ids[-STOP_SEQUENCE_WINDOW:], skip_special_tokens=True)
+            return any(sequence in tail for sequence in self.stop_sequences)
+
+        return False
+
+
+# ---------------------------------------------------
+# 🔹 Request
+# ---------------------------------------------------
+
+class GenerationRequest:
+    """
+    One pending prompt and the future its caller is waiting on.
+
+    stop is an optional callable on the text generated so far; the row
+    finishes as soon as it returns True. prefix is a static leading part
+    of the prompt whose key/values the engine may reuse. Streaming
+    requests also get a queue of text deltas terminated by None.
+    Time spent waiting, tokenizing, prefilling and decoding is added to
+    the submitting request's timing breakdown.
+    """
+
+    def __init__(self, prompt: str, max_new_tokens: int, stop=None, stream: bool = False,
+                 tier: str = "default", prefix: str = None):
+        self.prompt = prompt
+        self.prompt_ids = None
+        self.prefix = prefix
+        self.reused_tokens = 0
+        self.max_new_tokens = max_new_tokens
+        self.stop = stop
+        self.tier = tier
+        self.stream = queue.Queue() if stream else None
+        self.future = Future()
+        self.token_ids = []
+        self.text = ""
+        self.cancelled = False
+        self.has_content = False
+        self.stopped_early = False
+        self.timings = current_timings()
+        self.submitted_at = time.perf_counter()
+        self.prefilled_at = None
+
+    def push(self, text: str):
+        """
+        Record newly decoded text and forward the delta to the stream.
+        """
+
+        if self.stream is not None and len(text) > len(self.text):
+            self.stream.put(text[len(self.text):])
+        self.text = text
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.put(None)
+
+
+# ---------------------------------------------------
+# 🔹 Continuous Batching Engine
+# ---------------------------------------------------
+
+class GenerationEngine:
+    """
+    Greedy decoding scheduler shared by the SLM and RAG tiers.
+
+    Pending prompts are prefilled together as a left-padded batch and
+    merged into the running decode batch. Every step decodes one token
+    for all active rows. Finished rows leave the batch immediately and
+    free their slot for the next waiting prompt.
+
+    stop_criteria (a StopCriteria) applies to every request; per-tier
+    stats record how many decode steps early stopping saved.
+
+    Requests that name a prompt prefix skip its prefill: the prefix is
+    run once, its key/values are kept, and later prompts only prefill
+    the remaining suffix on top of them.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size: int = MAX_BATCH_SIZE,
+                 repetition_penalty: float = REPETITION_PENALTY, stop_criteria=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.repetition_penalty = repetition_penalty
+        self.stop_criteria = stop_criteria
+
+        self.eos_token_id = tokenizer.eos_token_id
+        self.max_positions = getattr(model.config, "n_positions", None) or getattr(
+            model.config, "max_position_embeddings", None
+        )
+
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._stats = defaultdict(lambda: {
+            "requests": 0,
+            "decode_steps": 0,
+            "early_stops": 0,
+            "decode_steps_saved": 0,
+            "prefill_tokens_reused": 0,
+            "decode_seconds": 0.0,
+        })
+        self._decoded_tokens = 0
+        self._decode_seconds = 0.0
+        self._prefixes = OrderedDict()   # prefix -> (token ids, per-layer (key, value))
+        self._reset_batch()
+
+        # Threads do not survive fork(); pre-forked workers start their own
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    # ---------------- Public API ----------------
+
+    def submit(self, prompt: str, max_new_tokens: int, stop=None, tier: str = "default",
+               prefix: str = None) -> Future:
+        request = GenerationRequest(prompt, max_new_tokens, stop=stop, tier=tier, prefix=prefix)
+        self._enqueue(request)
+        return request.future
+
+    def generate(self, prompt: str, max_new_tokens: int, stop=None, tier: str = "default",
+                 prefix: str = None) -> str:
+        return self.submit(prompt, max_new_tokens, stop=stop, tier=tier, prefix=prefix).result()
+
+    def stream(self, prompt: str, max_new_tokens: int, stop=None, tier: str = "default",
+               prefix: str = None):
+        """
+        Yield generated text deltas as soon as each token is decoded.
+        Closing the generator early cancels the request.
+        """
+
+        request = GenerationRequest(prompt, max_new_tokens, stop=stop, stream=True, tier=tier,
+                                    prefix=prefix)
+        self._enqueue(request)
+
+        try:
+            while True:
+                delta = request.stream.get()
+                if delta is None:
+                    break
+                yield delta
+        finally:
+            request.cancelled = True
+
+        # Surface generation errors to the consumer
+        request.future.result()
+
+    def stats(self) -> dict:
+        """
+        Per-tier decode counters, including steps saved by early stopping.
+        """
+
+        with self._lock:
+            return {
+                tier: {key: round(value, 3) if isinstance(value, float) else value for key, value in values.items()}
+                for tier, values in self._stats.items()
+            }
+
+    def scheduler_stats(self) -> dict:
+        """
+        Queue depth, running batch size and decode throughput (tokens per
+        second of decode step time, summed over the batch).
+        """
+
+        with self._lock:
+            return {
+                "waiting": self._pending.qsize(),
+                "active": len(self._active),
+                "tokens_per_second": (
+                    round(self._decoded_tokens / self._decode_seconds, 2) if self._decode_seconds else 0.0
+                ),
+            }
+
+    def _enqueue(self, request: GenerationRequest):
+        """
+        Tokenize on the caller's thread and reject a prompt that does
+        not fit the model's positions before it reaches a batch.
+        """
+
+        started = time.perf_counter()
+        request.prompt_ids = self.tokenizer(request.prompt)["input_ids"]
+        record("tokenize", (time.perf_counter() - started) * 1000, request.timings)
+
+        if self.max_positions and len(request.prompt_ids) >= self.max_positions:
+            self._fail([request], PromptTooLong(
+                f"Prompt of {len(request.prompt_ids)} tokens does not fit in {self.max_positions} positions"
+            ))
+            return
+
+        self._ensure_worker()
+        self._pending.put(request)
+
+    # ---------------- Worker ----------------
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="generation-engine", daemon=True
+                )
+                self._worker.start()
+
+    def _run(self):
+        with torch.inference_mode():
+            while True:
+                new_requests = []
+                if not self._active:
+                    new_requests.append(self._pending.get())
+
+                while len(self._active) + len(new_requests) < self.max_batch_size:
+                    try:
+                        new_requests.append(self._pending.get_nowait())
+                    except queue.Empty:
+                        break
+
+                if new_requests:
+                    self._admit(new_requests)
+
+                if self._active:
+                    self._step()
+
+    def _after_fork(self):
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._reset_batch()
+
+    def _reset_batch(self):
+        self._active = []
+        self._past = None          # per-layer (key, value), shape [B, H, L, D]
+        self._mask = None          # [B, L] attention mask
+        self._positions = None     # [B] position id of the next input token
+        self._next_tokens = None   # [B] token fed into the next decode step
+        self._seen = None          # [B, V] tokens seen, for repetition penalty
+
+    def _fail(self, requests, exc):
+        for request in requests:
+            if not request.future.done():
+                request.future.set_exception(exc)
+            request.close()
+
+    # ---------------- Prefill ----------------
+
+    def _admit(self, requests):
+        started = time.perf_counter()
+        for request in requests:
+            record("engine_wait", (started - request.submitted_at) * 1000, request.timings)
+
+        self._merge(requests)
+
+    def _merge(self, requests):
+        """
+        Prefill new requests and merge them into the running batch.
+        """
+
+        try:
+            state = self._prefill(requests)
+        except Exception as exc:
+            if len(requests) == 1:
+                self._fail(requests, exc)
+                return
+
+            # Retry each prompt on its own so only the faulty one fails
+            for request in requests:
+                self._merge([request])
+            return
+
+        past, mask, positions, logits, seen = state
+
+        if self._active:
+            length = max(self._mask.shape[1], mask.shape[1])
+            past = [
+                (
+                    torch.cat([_left_pad(k_old, length, 2), _left_pad(k_new, length, 2)]),
+                    torch.cat([_left_pad(v_old, length, 2), _left_pad(v_new, length, 2)]),
+                )
+                for (k_old, v_old), (k_new, v_new) in zip(self._past, past)
+            ]
+            mask = torch.cat([_left_pad(self._mask, length, 1), _left_pad(mask, length, 1)])
+            positions = torch.cat([self._positions, positions])
+            seen = torch.cat([self._seen, seen])
+            next_tokens = torch.cat([self._next_tokens, torch.zeros_like(positions[len(self._active):])])
+        else:
+            next_tokens = torch.zeros_like(positions)
+
+        first = len(self._active)
+        self._active = self._active + list(requests)
+        self._past, self._mask, self._positions, self._seen = past, mask, positions, seen
+        self._next_tokens = next_tokens
+
+        rows = torch.arange(first, len(self._active))
+        tokens = self._select(logits, self._seen[rows])
+        self._record(rows, tokens)
+
+    def _cached_prefix(self, request: GenerationRequest, ids):
+        """
+        (token count, per-layer key/values) of the request's prefix, or
+        None when it has none or the prompt tokenizes differently across
+        the prefix boundary.
+        """
+
+        if request.prefix is None or not request.prompt.startswith(request.prefix):
+            return None
+
+        entry = self._prefixes.get(request.prefix)
+        if entry is None:
+            prefix_ids = self.tokenizer(request.prefix)["input_ids"]
+            outputs = self.model(
+                input_ids=torch.tensor([prefix_ids], dtype=torch.long, device=self.model.device),
+                past_key_values=_to_cache(None),
+                use_cache=True,
+            )
+            entry = (prefix_ids, _from_cache(outputs.past_key_values))
+            self._prefixes[request.prefix] = entry
+            if len(self._prefixes) > MAX_CACHED_PREFIXES:
+                self._prefixes.popitem(last=False)
+
+        prefix_ids, past = entry
+        if len(ids) <= len(prefix_ids) or ids[:len(prefix_ids)] != prefix_ids:
+            return None
+
+        return len(prefix_ids), past
+
+    def _prefill(self, requests):
+        """
+        Prefill a batch of prompts.
+
+        Rows with a cached prefix only feed their suffix tokens, on top of
+        the prefix key/values placed right-aligned in the past. Padding
+        between prefix and suffix is masked out and position ids continue
+        from the prefix, so the result matches a full prefill.
+        """
+
+        device = self.model.device
+
+        started = time.perf_counter()
+        encoded = [r.prompt_ids for r in requests]
+
+        prefixes = [self._cached_prefix(r, ids) for r, ids in zip(requests, encoded)]
+
+        reused = [0 if prefix is None else prefix[0] for prefix in prefixes]
+        suffixes = [ids[n:] for ids, n in zip(encoded, reused)]
+        past_length = max(reused)
+        length = max(len(ids) for ids in suffixes)
+
+        input_ids = torch.full((len(encoded), length), self.eos_token_id, dtype=torch.long)
+        mask = torch.zeros((len(encoded), past_length + length), dtype=torch.long)
+        for row, ids in enumerate(suffixes):
+            input_ids[row, length - len(ids):] = torch.tensor(ids, dtype=torch.long)
+            mask[row, past_length + length - len(ids):] = 1
+            mask[row, past_length - reused[row]:past_length] = 1
+
+        past = None
+        if past_length:
+            template = next(prefix[1] for prefix in prefixes if prefix is not None)
+            past = [
+                tuple(
+                    tensor.new_zeros((len(encoded), tensor.shape[1], past_length, tensor.shape[3]))
+                    for tensor in layer
+                )
+                for layer in template
+            ]
+            for row, prefix in enumerate(prefixes):
+                if prefix is None:
+                    continue
+                n, prefix_past = prefix
+                requests[row].reused_tokens = n
+                for (k, v), (k_prefix, v_prefix) in zip(past, prefix_past):
+                    k[row, :, past_length - n:] = k_prefix[0]
+                    v[row, :, past_length - n:] = v_prefix[0]
+
+        input_ids, mask = input_ids.to(device), mask.to(device)
+        position_ids = (mask.cumsum(-1) - 1).clamp(min=0)[:, past_length:]
+
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=mask,
+            position_ids=position_ids,
+            past_key_values=_to_cache(past),
+            use_cache=True,
+        )
+
+        # Vocabulary size from the logits, which also holds for quantized heads
+        seen = torch.zeros((len(encoded), outputs.logits.shape[-1]), dtype=torch.bool, device=device)
+        for row, ids in enumerate(encoded):
+            seen[row, ids] = True
+
+        # Batch-wide times: every row waits for the whole batch
+        done = time.perf_counter()
+        for request in requests:
+            record("prefill", (done - started) * 1000, request.timings)
+            request.prefilled_at = done
+
+        positions = mask.sum(-1)
+        return _from_cache(outputs.past_key_values), mask, positions, outputs.logits[:, -1, :], seen
+
+    # ---------------- Decode ----------------
+
+    def _step(self):
+        device = self.model.device
+        mask = torch.cat([self._mask, torch.ones((len(self._active), 1), dtype=torch.long, device=device)], dim=1)
+        started = time.perf_counter()
+
+        try:
+            outputs = self.model(
+                input_ids=self._next_tokens[:, None],
+                attention_mask=mask,
+                position_ids=self._positions[:, None],
+                past_key_values=_to_cache(self._past),
+                use_cache=True,
+            )
+        except Exception as exc:
+            self._fail(self._active, exc)
+            self._reset_batch()
+            return
+
+        self._past = _from_cache(outputs.past_key_values)
+        self._mask = mask
+        self._positions = self._positions + 1
+
+        with self._lock:
+            self._decoded_tokens += len(self._active)
+            self._decode_seconds += time.perf_counter() - started
+
+        rows = torch.arange(len(self._active))
+        tokens = self._select(outputs.logits[:, -1, :], self._seen)
+        self._record(rows, tokens)
+
+    def _select(self, logits, seen):
+        """
+        Greedy choice with the same repetition penalty as model.generate.
+        """
+
+        penalised = torch.where(logits < 0, logits * self.repetition_penalty, logits / self.repetition_penalty)
+        logits = torch.where(seen, penalised, logits)
+        return logits.argmax(dim=-1)
+
+    def _record(self, rows, tokens):
+        self._next_tokens[rows] = tokens
+        self._seen[rows, tokens] = True
+
+        finished = []
+        for row, token in zip(rows.tolist(), tokens.tolist()):
+            request = self._active[row]
+            request.token_ids.append(token)
+
+            if request.stop is not None or request.stream is not None:
+                text = self.tokenizer.decode(request.token_ids, skip_special_tokens=True)
+                # Hold back incomplete multi-byte characters
+                if not text.endswith("\ufffd"):
+                    request.push(text)
+
+            request.stopped_early = (
+                request.cancelled
+                or (self.stop_criteria is not None and self.stop_criteria(request, token))
+                or (request.stop is not None and request.stop(request.text))
+            )
+
+            if (
+                request.stopped_early
+                or token == self.eos_token_id
+                or len(request.token_ids) >= request.max_new_tokens
+                or (self.max_positions and int(self._positions[row]) + 1 >= self.max_positions)
+            ):
+                finished.append(row)
+
+        if finished:
+            self._finish(finished)
+
+    def _count(self, request: GenerationRequest):
+        steps = len(request.token_ids)
+        decode_seconds = time.perf_counter() - request.prefilled_at
+        record("decode", decode_seconds * 1000, request.timings)
+
+        with self._lock:
+            stats = self._stats[request.tier]
+            stats["requests"] += 1
+            stats["decode_steps"] += steps
+            stats["decode_seconds"] += decode_seconds
+            stats["prefill_tokens_reused"] += request.reused_tokens
+            if request.stopped_early and steps < request.max_new_tokens:
+                stats["early_stops"] += 1
+                stats["decode_steps_saved"] += request.max_new_tokens - steps
+
+    def _finish(self, rows):
+        for row in rows:
+            request = self._active[row]
+            text = self.tokenizer.decode(request.token_ids, skip_special_tokens=True)
+            request.push(text)
+            # Timings are complete before the caller can read them
+            self._count(request)
+            request.future.set_result(text)
+            request.close()
+
+        done = set(rows)
+        keep = [row for row in range(len(self._active)) if row not in done]
+        if not keep:
+            self._reset_batch()
+            return
+
+        index = torch.tensor(keep, device=self._mask.device)
+        self._active = [self._active[row] for row in keep]
+        self._past = [(k.index_select(0, index), v.index_select(0, index)) for k, v in self._past]
+        self._mask = self._mask.index_select(0, index)
+        self._positions = self._positions.index_select(0, index)
+        self._next_tokens = self._next_tokens.index_select(0, index)
+        self._seen = self._seen.index_select(0, index)
+
+        # Drop leading columns that are padding for every remaining row
+        start = int(self._mask.any(dim=0).int().argmax())
+        if start:
+            self._past = [(k[:, :, start:], v[:, :, start:]) for k, v in self._past]
+            self._mask = self._mask[:, start:]
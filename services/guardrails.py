@@ -1,26 +1,17 @@
+import json
+import os
 import re
+import threading
+import time
 
-# Sensitive patterns to block (strictly private / harmful requests)
-SENSITIVE_PATTERNS = [
-    r"account number",
-    r"password",
-    r"\botp\b",
-    r"credit card number",
-    r"\bcvv\b",
-    r"customer data",
-    r"\bbalance\b",
-    r"pan number",
-    r"aadhar number",
-    r"ssn",
-    r"bitcoin",
-    r"crypto",
-    r"politics",
-    r"election",
-    r"elections",
-    r"link",
-    r"url",
-    r"website"
-]
+# ---------------------------------------------------
+# 🔹 Configuration
+# ---------------------------------------------------
+
+# Rule sets by name. "blocked" refuses the query; "complex" routes it
+# to the RAG tier. Edits are picked up without a restart.
+RULES_PATH = "data/guardrail_rules.json"
+RELOAD_CHECK_INTERVAL = 5   # seconds between config mtime checks
 
 REFUSAL_MESSAGE = (
     "I'm unable to assist with that request. "
@@ -28,12 +19,189 @@ REFUSAL_MESSAGE = (
 )
 
 
+# ---------------------------------------------------
+# 🔹 Compiled Rule Set (one regex, one pass)
+# ---------------------------------------------------
+
+def _trie_pattern(words) -> str:
+    """
+    Regex matching any of the words, factored as a prefix trie so each
+    position costs at most one step per character, not one per word.
+    """
+
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def pattern(node) -> str:
+        branches = [re.escape(char) + pattern(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        return f"(?:{body})?" if "" in node else body
+
+    return pattern(trie)
+
+
+class RuleSet:
+    """
+    A list of rules compiled into a single regex.
+
+    Each rule is {"name", "pattern"} plus optional "regex" (pattern is a
+    regex rather than a literal), "word" (literal must match whole words)
+    and "message". Literals share two tries, with and without word
+    boundaries; each regex rule becomes its own named alternative.
+    Earlier rules win when several match.
+
+    With ignore_case, text is lowercased before matching (regex rules
+    see lowercase text), so a matched literal is always a trie key.
+    """
+
+    def __init__(self, rules, ignore_case: bool = True):
+        self.rules = list(rules)
+        self.ignore_case = ignore_case
+
+        self._priority = {rule["name"]: i for i, rule in enumerate(self.rules)}
+        self._literals = {}   # matched text -> rule
+        self._groups = {}     # named group -> rule
+
+        words, plain = [], []
+        alternatives = []
+
+        for i, rule in enumerate(self.rules):
+            if rule.get("regex"):
+                group = f"r{i}"
+                alternatives.append(f"(?P<{group}>{rule['pattern']})")
+                self._groups[group] = rule
+                continue
+
+            literal = rule["pattern"].lower() if ignore_case else rule["pattern"]
+            self._literals.setdefault(literal, rule)
+            (words if rule.get("word") else plain).append(literal)
+
+        if words:
+            alternatives.insert(0, rf"(?P<word>\b{_trie_pattern(words)}\b)")
+        if plain:
+            alternatives.insert(0, f"(?P<plain>{_trie_pattern(plain)})")
+
+        self.pattern = re.compile("|".join(alternatives)) if alternatives else None
+
+    def _rule(self, match):
+        if match.lastgroup in ("word", "plain"):
+            return self._literals[match.group()]
+        return self._groups[match.lastgroup]
+
+    def match(self, text: str):
+        """
+        Highest-priority rule matching the text, or None.
+        """
+
+        if self.pattern is None:
+            return None
+
+        if self.ignore_case:
+            text = text.lower()
+
+        best = None
+        for match in self.pattern.finditer(text):
+            rule = self._rule(match)
+            if best is None or self._priority[rule["name"]] < self._priority[best["name"]]:
+                best = rule
+                if self._priority[best["name"]] == 0:
+                    break
+
+        return best
+
+
+# ---------------------------------------------------
+# 🔹 Guardrail Engine (reloadable rule sets)
+# ---------------------------------------------------
+
+class Guardrails:
+    """
+    Rule sets loaded from a JSON config file.
+    The file is re-read when its mtime changes; a broken edit keeps the
+    previous rules in place.
+    """
+
+    def __init__(self, path: str = RULES_PATH):
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._hits = {}
+        self._checked_at = 0.0
+        self._mtime = None
+
+        self._rule_sets, self.refusal_message = self._load()
+        self._mtime = os.path.getmtime(path)
+
+    def _load(self):
+        with open(self.path, "r") as f:
+            config = json.load(f)
+
+        refusal_message = config.pop("refusal_message", REFUSAL_MESSAGE)
+        rule_sets = {name: RuleSet(rules) for name, rules in config.items()}
+        return rule_sets, refusal_message
+
+    def reload(self):
+        """
+        Re-read the config file now.
+        """
+
+        rule_sets, refusal_message = self._load()
+        self._rule_sets, self.refusal_message = rule_sets, refusal_message
+        print(f"✅ Guardrail rules loaded from {self.path}.")
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime != self._mtime:
+                self._mtime = mtime
+                self.reload()
+        except (OSError, ValueError, KeyError, re.error) as exc:
+            print(f"⚠️ Could not reload guardrail rules: {exc}")
+
+    def match(self, rule_set: str, text: str):
+        """
+        Rule from the named set that fires on the text, or None.
+        """
+
+        self._maybe_reload()
+
+        rules = self._rule_sets.get(rule_set)
+        rule = rules.match(text) if rules is not None else None
+
+        if rule is not None:
+            key = f"{rule_set}:{rule['name']}"
+            with self._lock:
+                self._hits[key] = self._hits.get(key, 0) + 1
+
+        return rule
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rules": {name: len(rules.rules) for name, rules in self._rule_sets.items()},
+                "hits": dict(self._hits),
+            }
+
+
+guardrails = Guardrails()
+
+
 def contains_sensitive_request(query: str) -> bool:
     """
     Checks if the query contains sensitive or restricted patterns.
     """
-    query_lower = query.lower()
-    return any(re.search(pattern, query_lower) for pattern in SENSITIVE_PATTERNS)
+    return guardrails.match("blocked", query) is not None
 
 
 def apply_guardrails(query: str):
@@ -41,16 +209,13 @@ def apply_guardrails(query: str):
     Applies security guardrails.
 
     Returns:
-        (is_blocked: bool, message: str or None)
+        (is_blocked: bool, message: str or None, rule: str or None)
     """
 
     # Block sensitive requests
-    if contains_sensitive_request(query):
-        return True, REFUSAL_MESSAGE
+    rule = guardrails.match("blocked", query)
+    if rule is not None:
+        return True, rule.get("message", guardrails.refusal_message), rule["name"]
 
     # Allow everything else
-    return False, None
-
-
-
-
+    return False, None, None
@@ -0,0 +1,23 @@
+import threading
+
+# ---------------------------------------------------
+# 🔹 Model Construction (one at a time)
+# ---------------------------------------------------
+# from_pretrained is not safe to run concurrently: parallel loads can
+# leave tied weights (e.g. the SLM's lm_head) on the meta device. Every
+# model is built under this lock; index and file I/O still load in
+# parallel.
+
+model_load_lock = threading.Lock()
+
+
+def check_materialized(model, name: str):
+    """
+    Raise if any parameter or buffer of a loaded model is still on the
+    meta device.
+    """
+
+    tensors = list(model.named_parameters()) + list(model.named_buffers())
+    missing = [key for key, tensor in tensors if tensor.device.type == "meta"]
+    if missing:
+        raise RuntimeError(f"{name} model loaded with weights on the meta device: {', '.join(missing[:5])}")
@@ -0,0 +1,194 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# ---------------------------------------------------
+# 🔹 Configuration
+# ---------------------------------------------------
+
+METRIC_PREFIX = "bfsi_assistant"
+
+# Histogram upper bounds in seconds, from guardrail checks to full
+# generations
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# ---------------------------------------------------
+# 🔹 Per-Request Timing Breakdown
+# ---------------------------------------------------
+# Each request carries a dict of stage -> milliseconds in a context
+# variable. Stage pools copy the context into their worker threads and
+# the generation engine keeps a reference on each request, so stages
+# record into the right request from any thread. Outside a request
+# nothing is recorded.
+
+_timings = ContextVar("request_timings", default=None)
+
+
+def start_request(timings: dict = None) -> dict:
+    """
+    Attach a (new or existing) timing dict to the current context.
+    """
+
+    timings = {} if timings is None else timings
+    _timings.set(timings)
+    return timings
+
+
+def current_timings():
+    return _timings.get()
+
+
+def record(stage: str, ms: float, timings: dict = None):
+    """
+    Add ms to a stage of the given request, or of the current one.
+    """
+
+    if timings is None:
+        timings = _timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + ms
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    Time the enclosed block as one stage of the current request.
+    """
+
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def server_timing(timings: dict) -> str:
+    """
+    Server-Timing header value for a timing breakdown.
+    """
+
+    return ", ".join(f"{stage};dur={ms:.3f}" for stage, ms in timings.items())
+
+
+# ---------------------------------------------------
+# 🔹 Histograms and Counters
+# ---------------------------------------------------
+
+class Histogram:
+    """
+    Fixed-bucket histogram of seconds.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last slot is +Inf
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += seconds
+
+
+def _labels(**labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+class Metrics:
+    """
+    Request latency per tier, stage latency per (tier, stage) and
+    answers per tier. A request's stages are observed when it finishes,
+    once its tier is known, under a single lock acquisition.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = {}   # tier -> Histogram
+        self._stages = {}     # (tier, stage) -> Histogram
+        self._answers = {}    # tier -> count
+
+    def observe_request(self, tier: str, seconds: float, timings: dict = None, count: bool = True):
+        """
+        Record a finished request. count=False keeps it out of the
+        per-tier answer counts (e.g. a batch, counted per item).
+        """
+
+        with self._lock:
+            self._requests.setdefault(tier, Histogram()).observe(seconds)
+            for stage, ms in (timings or {}).items():
+                self._stages.setdefault((tier, stage), Histogram()).observe(ms / 1000)
+            if count:
+                self._answers[tier] = self._answers.get(tier, 0) + 1
+
+    def count_answer(self, tier: str):
+        with self._lock:
+            self._answers[tier] = self._answers.get(tier, 0) + 1
+
+    def tier_ratios(self) -> dict:
+        with self._lock:
+            total = sum(self._answers.values())
+            return {tier: round(n / total, 4) for tier, n in self._answers.items()} if total else {}
+
+    def _histogram_lines(self, name: str, help_text: str, histograms: dict, label_names) -> list:
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for key, histogram in sorted(histograms.items()):
+            labels = dict(zip(label_names, key if isinstance(key, tuple) else (key,)))
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+            cumulative += histogram.counts[-1]
+            lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {cumulative}")
+            lines.append(f"{name}_sum{_labels(**labels)} {histogram.total:.6f}")
+            lines.append(f"{name}_count{_labels(**labels)} {cumulative}")
+        return lines
+
+    def render(self, gauges=()) -> str:
+        """
+        Prometheus text format. gauges is a list of
+        (name, help, type, [(labels dict, value)]) from other components.
+        """
+
+        with self._lock:
+            lines = self._histogram_lines(
+                f"{METRIC_PREFIX}_request_duration_seconds", "End-to-end query latency by answering tier.",
+                self._requests, ("tier",)
+            )
+            lines += self._histogram_lines(
+                f"{METRIC_PREFIX}_stage_duration_seconds", "Time per pipeline stage by answering tier.",
+                self._stages, ("tier", "stage")
+            )
+            answers = dict(self._answers)
+
+        total = sum(answers.values())
+        gauges = [
+            ("answers_total", "Queries answered per tier.", "counter",
+             [({"tier": tier}, n) for tier, n in sorted(answers.items())]),
+            ("tier_ratio", "Share of answered queries per tier.", "gauge",
+             [({"tier": tier}, n / total) for tier, n in sorted(answers.items())] if total else []),
+            *gauges,
+        ]
+
+        for name, help_text, kind, samples in gauges:
+            name = f"{METRIC_PREFIX}_{name}"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{_labels(**labels)} {value:g}" for labels, value in samples]
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -1,91 +1,340 @@
+import os
 import re
-import torch
+import threading
 from transformers import AutoModelForCausalLM, AutoTokenizer
-from services.rag import retrieve
+from services.rag import retrieve_chunks
+from services.generation import GenerationEngine, StopCriteria
+from services.guardrails import RuleSet
+from services.loading import check_materialized, model_load_lock
+from services.metrics import timed
+from services.quantization import quantize_int8
 
 MODEL_PATH = "./models/slm"
 
-# Load tokenizer and model once
-tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-model = AutoModelForCausalLM.from_pretrained(MODEL_PATH)
+# "fp32" (eager PyTorch) or "int8" (dynamic quantization of the linear
+# layers); check_quantization.py compares the two on the dataset prompts
+SLM_BACKEND = "fp32"
 
-model.eval()
 
+def load_model(backend: str = SLM_BACKEND):
+    with model_load_lock:
+        if os.path.exists(os.path.join(MODEL_PATH, "adapter_config.json")):
+            # LoRA adapters from train_slm.py --lora, merged into the base
+            # weights once so decoding runs on a plain model
+            from peft import AutoPeftModelForCausalLM
+            slm = AutoPeftModelForCausalLM.from_pretrained(MODEL_PATH).merge_and_unload()
+        else:
+            slm = AutoModelForCausalLM.from_pretrained(MODEL_PATH)
+    check_materialized(slm, "SLM")
+    slm.eval()
 
-# ---------------------------------------------------
-# 🔹 Common generation helper
-# ---------------------------------------------------
+    if backend == "int8":
+        slm = quantize_int8(slm)
+    elif backend != "fp32":
+        raise ValueError(f"Unknown SLM backend: {backend}")
+
+    return slm
+
+
+STOP_TOKENS = ["### Policy Context:", "### Customer Query:", "### Response:"]
+
+# RAG context: candidates retrieved, then packed into a fixed budget of
+# SLM tokens to bound prefill cost
+RAG_CANDIDATES = 5
+RAG_CONTEXT_TOKENS = 320
+
+# Tokenizer, model and engine are loaded once, on startup or first use
+tokenizer = None
+model = None
+engine = None
+_load_lock = threading.Lock()
 
-def _generate_text(prompt: str, max_tokens: int = 120) -> str:
+
+def load_slm():
     """
-    Internal helper for deterministic text generation.
+    Load the tokenizer and model and start the shared engine once.
     """
 
-    inputs = tokenizer(prompt, return_tensors="pt")
+    global tokenizer, model, engine
+
+    if engine is not None:
+        return
+
+    with _load_lock:
+        if engine is None:
+            with model_load_lock:
+                tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
+            model = load_model()
+
+            # Shared batching scheduler for the SLM and RAG tiers.
+            # Rows stop on a repeated prompt marker or at the end of the
+            # first paragraph, which is all _post_process keeps.
+            engine = GenerationEngine(
+                model,
+                tokenizer,
+                stop_criteria=StopCriteria(tokenizer, STOP_TOKENS, first_paragraph=True)
+            )
+
+URL_PATTERN = r"http|www"
+LARGE_NUMBER_PATTERN = r"\d{4,}"
+ARTIFACT_PATTERN = r"[*\[\]]+"
+
+# Answers that must not be shown, checked in one pass in priority order.
+# Kept in code: the streaming hold-back in _held_back_length mirrors them.
+OUTPUT_RULES = RuleSet([
+    {
+        "name": "url",
+        "pattern": URL_PATTERN,
+        "regex": True,
+        "message": "For accurate and policy-aligned information, please contact official customer support.",
+    },
+    {
+        "name": "large_number",
+        "pattern": LARGE_NUMBER_PATTERN,
+        "regex": True,
+        "message": "For accurate financial details, please refer to official banking channels.",
+    },
+], ignore_case=False)
 
-    with torch.no_grad():
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=max_tokens,
-            temperature=0.0,           # deterministic
-            do_sample=False,
-            repetition_penalty=1.2
-        )
 
-    full_output = tokenizer.decode(outputs[0], skip_special_tokens=True)
+# ---------------------------------------------------
+# 🔹 Common generation helper
+# ---------------------------------------------------
 
-    # Extract only generated portion
-    generated = full_output[len(prompt):].strip()
+def _trim_stop_markers(generated: str) -> str:
+    """
+    Cut generated text where the prompt structure starts repeating.
+    """
 
-    # Stop if structure repeats
-    stop_tokens = ["### Policy Context:", "### Customer Query:", "### Response:"]
-    for token in stop_tokens:
+    generated = generated.strip()
+
+    for token in STOP_TOKENS:
         if token in generated:
             generated = generated.split(token)[0]
 
     return generated.strip()
 
 
+def _generate_text(prompt: str, max_tokens: int = 120, tier: str = "default", prefix: str = None) -> str:
+    """
+    Internal helper for deterministic text generation.
+    Greedy decoding with repetition penalty, batched with other
+    concurrent requests by the shared generation engine.
+    prefix is the prompt's static preamble, prefilled once and reused.
+    """
+
+    # Engine returns only the generated portion
+    generated = engine.generate(prompt, max_tokens, tier=tier, prefix=prefix)
+
+    # Stop if structure repeats
+    return _trim_stop_markers(generated)
+
+
 # ---------------------------------------------------
-# 🔹 Tier 2: Pure SLM (No Retrieval)
+# 🔹 Streaming generation helper
 # ---------------------------------------------------
 
-def generate_slm_response(query: str) -> str:
+def _held_back_length(text: str) -> int:
     """
-    Controlled fallback generation without retrieval.
+    Length of the trailing text that may still grow into a stop marker,
+    a blocked URL keyword or a blocked large number.
     """
 
-    prompt = f"""
+    held = 0
+    for word in STOP_TOKENS + ["http", "www"]:
+        for size in range(min(len(word) - 1, len(text)), held, -1):
+            if text.endswith(word[:size]):
+                held = size
+                break
+
+    digits = re.search(r"\d{1,3}$", text)
+    if digits:
+        held = max(held, len(digits.group()))
+
+    return held
+
+
+def _visible_prefix(generated: str):
+    """
+    The part of the final answer that is already safe to stream.
+
+    Applies the same stop-marker cut, first-paragraph truncation and
+    compliance checks as the non-streaming path, and holds back any tail
+    that could still turn into something _post_process would reject.
+
+    Returns:
+        (visible: str, complete: bool, blocked: bool)
+    """
+
+    text = generated.lstrip()
+    complete = False
+
+    for token in STOP_TOKENS:
+        if token in text:
+            text = text.split(token)[0]
+            complete = True
+
+    if "\n" in text:
+        text = text.split("\n")[0]
+        complete = True
+
+    if OUTPUT_RULES.match(text) is not None:
+        return "", True, True
+
+    if not complete:
+        text = text[:len(text) - _held_back_length(text)]
+
+    visible = re.sub(ARTIFACT_PATTERN, "", text).strip()
+    return visible, complete, False
+
+
+def _stream_complete(generated: str) -> bool:
+    """
+    Stopping criterion for streamed requests: the first paragraph is
+    finished, a stop marker appeared, or the answer will be blocked.
+    """
+
+    _, complete, blocked = _visible_prefix(generated)
+    return complete or blocked
+
+
+def _stream_text(prompt: str, max_tokens: int = 120, tier: str = "default", prefix: str = None):
+    """
+    Stream the post-processed answer for a prompt.
+
+    Yields ("token", delta) events while generating, then a single
+    ("done", response) event carrying the final compliant answer.
+    """
+
+    generated = ""
+    sent = ""
+
+    for delta in engine.stream(prompt, max_tokens, stop=_stream_complete, tier=tier, prefix=prefix):
+        generated += delta
+        visible, _, _ = _visible_prefix(generated)
+
+        if len(visible) > len(sent) and visible.startswith(sent):
+            yield "token", visible[len(sent):]
+            sent = visible
+
+    response = _post_process(_trim_stop_markers(generated))
+
+    # Flush the held-back tail once generation has ended
+    if len(response) > len(sent) and response.startswith(sent):
+        yield "token", response[len(sent):]
+
+    yield "done", response
+
+
+# ---------------------------------------------------
+# 🔹 Tier 2: Pure SLM (No Retrieval)
+# ---------------------------------------------------
+
+# Static preamble; its key/values are computed once by the engine
+SLM_PREAMBLE = """
 You are a compliant BFSI call center AI assistant.
 Provide a professional and policy-safe response.
 Do NOT generate specific financial numbers, links, or assumptions.
 If unsure, advise contacting official support.
 
 ### Customer Query:
-{query}
+"""
+
+
+def _build_slm_prompt(query: str) -> str:
+    return SLM_PREAMBLE + f"""{query}
 
 ### Response:
 """
 
-    response = _generate_text(prompt, max_tokens=100)
+
+def generate_slm_response(query: str) -> str:
+    """
+    Controlled fallback generation without retrieval.
+    """
+
+    load_slm()
+    prompt = _build_slm_prompt(query)
+
+    response = _generate_text(prompt, max_tokens=100, tier="slm", prefix=SLM_PREAMBLE)
 
     return _post_process(response)
 
 
+def stream_slm_response(query: str):
+    """
+    Streaming variant of generate_slm_response.
+    """
+
+    load_slm()
+    return _stream_text(_build_slm_prompt(query), max_tokens=100, tier="slm", prefix=SLM_PREAMBLE)
+
+
 # ---------------------------------------------------
 # 🔹 Tier 3: RAG-Based Generation
 # ---------------------------------------------------
 
-def generate_rag_response(query: str) -> str:
+def _token_count(text: str) -> int:
+    return len(tokenizer(text)["input_ids"])
+
+
+def _merge_chunks(first: dict, second: dict) -> dict:
     """
-    Retrieval-Augmented Generation.
-    Uses policy context strictly.
+    Union of two overlapping chunks from the same source.
     """
 
-    retrieved_docs = retrieve(query, top_k=3)
-    context = "\n\n".join(retrieved_docs)
+    if second["start"] < first["start"]:
+        first, second = second, first
+
+    text = first["text"]
+    if second["end"] > first["end"]:
+        text += second["text"][first["end"] - second["start"]:]
+
+    return {**first, "text": text, "end": max(first["end"], second["end"])}
+
+
+def _assemble_context(chunks, budget: int = RAG_CONTEXT_TOKENS) -> str:
+    """
+    Pack retrieved chunks, best first, into a fixed SLM token budget.
+
+    Overlapping chunks from the same source are merged so the overlap
+    is paid for once. A chunk that does not fit is skipped in favour of
+    smaller, lower-ranked ones.
+    """
+
+    packed = []
+    used = 0
+
+    for chunk in chunks:
+        overlapping = next((
+            i for i, part in enumerate(packed)
+            if part["source"] == chunk["source"]
+            and chunk["start"] < part["end"] and part["start"] < chunk["end"]
+        ), None)
+
+        if overlapping is not None:
+            merged = _merge_chunks(packed[overlapping], chunk)
+            extra = _token_count(merged["text"]) - _token_count(packed[overlapping]["text"])
+            if used + extra <= budget:
+                packed[overlapping] = merged
+                used += extra
+            continue
 
-    prompt = f"""
+        # Paragraph separator costs a token too
+        tokens = _token_count(chunk["text"]) + (1 if packed else 0)
+        if used + tokens <= budget:
+            packed.append(chunk)
+            used += tokens
+
+    if not packed and chunks:
+        # The best chunk alone exceeds the budget: keep its head
+        head = tokenizer(chunks[0]["text"])["input_ids"][:budget]
+        return tokenizer.decode(head)
+
+    return "\n\n".join(part["text"] for part in packed)
+
+
+RAG_PREAMBLE = """
 You are a compliant BFSI policy assistant.
 Answer strictly using the policy context below.
 Do NOT generate assumptions or external information.
@@ -93,7 +342,15 @@ If answer is not found in context, say:
 "I'm unable to find that information in the policy."
 
 ### Policy Context:
-{context}
+"""
+
+
+def _build_rag_prompt(query: str, query_embedding=None) -> str:
+    retrieved_chunks = retrieve_chunks(query, top_k=RAG_CANDIDATES, query_embedding=query_embedding)
+    with timed("context"):
+        context = _assemble_context(retrieved_chunks)
+
+    return RAG_PREAMBLE + f"""{context}
 
 ### Customer Query:
 {query}
@@ -101,11 +358,47 @@ If answer is not found in context, say:
 ### Response:
 """
 
-    response = _generate_text(prompt, max_tokens=120)
+
+def generate_rag_response(query: str, query_embedding=None) -> str:
+    """
+    Retrieval-Augmented Generation.
+    Uses policy context strictly.
+    """
+
+    load_slm()
+    prompt = _build_rag_prompt(query, query_embedding)
+
+    response = _generate_text(prompt, max_tokens=120, tier="rag", prefix=RAG_PREAMBLE)
 
     return _post_process(response)
 
 
+def stream_rag_response(query: str, query_embedding=None):
+    """
+    Streaming variant of generate_rag_response.
+    """
+
+    load_slm()
+    return _stream_text(_build_rag_prompt(query, query_embedding), max_tokens=120, tier="rag",
+                        prefix=RAG_PREAMBLE)
+
+
+def get_generation_stats() -> dict:
+    """
+    Decode steps spent and saved by early stopping, per tier.
+    """
+
+    return engine.stats() if engine is not None else {}
+
+
+def get_scheduler_stats() -> dict:
+    """
+    Generation queue depth, running batch size and decode throughput.
+    """
+
+    return engine.scheduler_stats() if engine is not None else {}
+
+
 # ---------------------------------------------------
 # 🔹 Safety Post-Processing
 # ---------------------------------------------------
@@ -115,16 +408,13 @@ def _post_process(response: str) -> str:
     Final compliance cleaning layer.
     """
 
-    # Block URLs
-    if re.search(r"http|www", response):
-        return "For accurate and policy-aligned information, please contact official customer support."
-
-    # Block large numeric hallucinations (like fake rates)
-    if re.search(r"\d{4,}", response):
-        return "For accurate financial details, please refer to official banking channels."
+    # Block URLs and large numeric hallucinations (like fake rates)
+    rule = OUTPUT_RULES.match(response)
+    if rule is not None:
+        return rule["message"]
 
     # Remove strange artifacts
-    response = re.sub(r"[*\[\]]+", "", response)
+    response = re.sub(ARTIFACT_PATTERN, "", response)
 
     # Keep only first paragraph
     response = response.split("\n")[0].strip()
@@ -0,0 +1,156 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from services.metrics import record
+
+# ---------------------------------------------------
+# 🔹 Configuration
+# ---------------------------------------------------
+
+# (worker threads, requests allowed to wait) per stage. Embedding and
+# generation workers mostly wait on their batching schedulers, so they
+# are sized to let a full batch form.
+STAGE_LIMITS = {
+    "embedding": (16, 64),
+    "search": (4, 64),
+    "generation": (8, 16),
+}
+
+RETRY_AFTER_SECONDS = 1
+
+
+# ---------------------------------------------------
+# 🔹 Bounded Stage Executor
+# ---------------------------------------------------
+
+class Overloaded(Exception):
+    """
+    Raised when a stage already holds as many requests as it allows.
+    """
+
+    def __init__(self, stage: str):
+        super().__init__(f"{stage} stage is at capacity")
+        self.stage = stage
+
+
+class Slot:
+    """
+    One reserved stage slot; releasing it more than once is a no-op.
+    """
+
+    def __init__(self, stage):
+        self._stage = stage
+        self._lock = threading.Lock()
+        self._released = False
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._stage.release()
+
+
+class Stage:
+    """
+    Thread pool with a hard cap on requests in flight.
+
+    At most workers calls run at once and queue_depth more may wait;
+    anything beyond that is rejected immediately with Overloaded rather
+    than queued, so latency under a spike stays bounded.
+    """
+
+    def __init__(self, name: str, workers: int, queue_depth: int):
+        self.name = name
+        self.workers = workers
+        self.capacity = workers + queue_depth
+
+        self._start()
+
+        # Pool threads do not survive fork(); pre-forked workers start fresh
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{self.name}-stage")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def acquire(self):
+        """
+        Count one more request in flight, or raise Overloaded.
+        Pair with release().
+        """
+
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                self._rejected += 1
+                raise Overloaded(self.name)
+            self._in_flight += 1
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._completed += 1
+
+    def hold(self) -> "Slot":
+        """
+        Reserve a slot held until the returned Slot is released.
+        """
+
+        self.acquire()
+        return Slot(self)
+
+    def submit(self, fn, *args, **kwargs):
+        self.acquire()
+
+        # Runs in the caller's context, so stages time into its request
+        context = contextvars.copy_context()
+        submitted_at = time.perf_counter()
+
+        def call():
+            record(f"{self.name}_wait", (time.perf_counter() - submitted_at) * 1000)
+            return fn(*args, **kwargs)
+
+        try:
+            future = self._executor.submit(context.run, call)
+        except BaseException:
+            self.release()
+            raise
+
+        # Released when the work finishes, even if the caller gave up
+        future.add_done_callback(lambda _: self.release())
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Await fn(*args, **kwargs) on this stage's workers.
+        """
+
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "capacity": self.capacity,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+
+stages = {name: Stage(name, *limits) for name, limits in STAGE_LIMITS.items()}
+
+embedding_stage = stages["embedding"]
+search_stage = stages["search"]
+generation_stage = stages["generation"]
+
+
+def pipeline_stats() -> dict:
+    return {name: stage.stats() for name, stage in stages.items()}
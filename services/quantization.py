@@ -0,0 +1,36 @@
+import torch
+from torch import nn
+from transformers.pytorch_utils import Conv1D
+
+# ---------------------------------------------------
+# 🔹 Int8 Dynamic Quantization (CPU)
+# ---------------------------------------------------
+# Linear weights are stored as int8 and activations quantized on the
+# fly per batch, which speeds up the matmuls that dominate CPU decoding.
+# Embeddings, layer norms and the KV cache stay fp32.
+
+
+def _conv1d_to_linear(module: nn.Module):
+    """
+    Swap GPT-2 style Conv1D layers (transposed linear weights) for
+    nn.Linear so dynamic quantization picks them up.
+    """
+
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            in_features, out_features = child.weight.shape
+            linear = nn.Linear(in_features, out_features)
+            linear.weight = nn.Parameter(child.weight.detach().t().contiguous())
+            linear.bias = nn.Parameter(child.bias.detach())
+            setattr(module, name, linear)
+        else:
+            _conv1d_to_linear(child)
+
+
+def quantize_int8(model: nn.Module) -> nn.Module:
+    """
+    Quantize every linear layer of an eval-mode model in place.
+    """
+
+    _conv1d_to_linear(model)
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
@@ -1,127 +1,487 @@
+import hashlib
+import json
+import math
 import os
+import shutil
+import threading
+import time
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from services.chunking import chunk_file
+from services.text_store import TextStore, write_text_store
+from services.metrics import timed
+from services.embeddings import (
+    EMBEDDING_MODEL_NAME,
+    SIMILARITY_MODE,
+    count_tokens,
+    encode_query,
+    encode_texts,
+    index_metric,
+    new_flat_index,
+    read_shared_index,
+    to_similarity,
+)
 
 # ---------------------------------------------------
 # 🔹 Configuration
 # ---------------------------------------------------
 
-EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
-
 KNOWLEDGE_DIR = "data/knowledge_docs"
-INDEX_PATH = "models/faiss_index.index"
-DOC_STORE_PATH = "models/doc_store.npy"
+
+# Each build writes a new version directory under RAG_DIR; CURRENT
+# names the active one and is swapped atomically.
+RAG_DIR = "models/rag"
+CURRENT_PATH = os.path.join(RAG_DIR, "CURRENT")
+INDEX_FILE = "faiss.index"
+DOC_STORE_FILE = "doc_store.bin"       # UTF-8 chunk texts
+DOC_OFFSETS_FILE = "doc_offsets.npy"   # byte offsets into DOC_STORE_FILE
+METADATA_FILE = "chunk_meta.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+MANIFEST_FILE = "manifest.json"
+
+# Manifest chunk keys are "<content hash>:<occurrence>"; versions built
+# with another key format are rebuilt rather than updated
+CHUNK_KEY_FORMAT = "hash:occurrence"
+
+KEEP_VERSIONS = 2          # version directories kept on disk
+RELOAD_CHECK_INTERVAL = 5  # seconds between CURRENT checks in workers
 
 TOP_K_DEFAULT = 3
 
+# Index type: "flat" (exact), "hnsw", "ivf_flat" or "ivf_pq"
+INDEX_TYPE = "flat"
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64        # default per-query search breadth
+
+IVF_NLIST = 1024           # upper bound; scaled down for small corpora
+IVF_NPROBE = 16            # default lists probed per query
+PQ_M = 48                  # sub-quantizers, must divide the embedding dim
+PQ_NBITS = 8
+
+# FAISS wants roughly this many training points per centroid
+TRAINING_POINTS_PER_CENTROID = 39
+
 
 # ---------------------------------------------------
-# 🔹 Load Embedding Model Once
+# 🔹 Index Factory (exact or approximate)
 # ---------------------------------------------------
 
-embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+def create_index(embeddings, index_type: str = INDEX_TYPE, ids=None):
+    """
+    Create and fill a FAISS index of the given type.
+    IVF variants are trained on the embeddings first. Corpora too small
+    to train the requested index fall back to an exact flat index.
+    With ids, vectors are added under those ids so they can later be
+    removed individually.
+    """
+
+    count, dimension = embeddings.shape
+    metric = index_metric()
+
+    if index_type == "flat":
+        index = new_flat_index(dimension)
+
+    elif index_type == "hnsw":
+        index = faiss.index_factory(dimension, f"HNSW{HNSW_M}", metric)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = min(IVF_NLIST, int(4 * math.sqrt(count)), count // TRAINING_POINTS_PER_CENTROID)
+        min_points = 2 ** PQ_NBITS if index_type == "ivf_pq" else 1
+
+        if nlist < 1 or count < min_points:
+            print(f"⚠️ {count} chunks are too few to train {index_type}; using a flat index.")
+            return create_index(embeddings, "flat", ids)
+
+        if index_type == "ivf_flat":
+            index = faiss.index_factory(dimension, f"IVF{nlist},Flat", metric)
+        else:
+            index = faiss.index_factory(dimension, f"IVF{nlist},PQ{PQ_M}x{PQ_NBITS}", metric)
+
+        index.train(embeddings)
+        index.nprobe = min(IVF_NPROBE, nlist)
+
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+
+    if ids is None:
+        index.add(embeddings)
+        return index
+
+    # IVF indexes store ids natively; others need an id map
+    if not isinstance(index, faiss.IndexIVF):
+        index = faiss.IndexIDMap(index)
+    index.add_with_ids(embeddings, ids)
+    return index
+
+
+def _base_index(index):
+    """
+    The index behind an IndexIDMap wrapper.
+    """
+
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def search_params(index, nprobe: int = None, ef_search: int = None):
+    """
+    Per-query FAISS search parameters for approximate indexes.
+    Returns None when nothing applies and the index defaults are used.
+    """
+
+    index = _base_index(index)
+
+    if nprobe is not None and isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=nprobe)
+
+    if ef_search is not None and isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search)
+
+    return None
 
 
 # ---------------------------------------------------
-# 🔹 Build FAISS Index (L2 Distance)
+# 🔹 Build FAISS Index
 # ---------------------------------------------------
 
-def build_index():
+def load_chunks():
     """
-    Build FAISS index using L2 distance.
-    Run once before starting API.
+    Split every .txt knowledge document into sentence-aligned chunks.
+    Each chunk is a dict with its text, source file and offsets.
     """
 
     all_chunks = []
 
     # Load all .txt knowledge documents
-    for filename in os.listdir(KNOWLEDGE_DIR):
+    for filename in sorted(os.listdir(KNOWLEDGE_DIR)):
         if filename.endswith(".txt"):
             file_path = os.path.join(KNOWLEDGE_DIR, filename)
+            all_chunks.extend(chunk_file(file_path, filename, count_tokens))
 
-            with open(file_path, "r", encoding="utf-8") as f:
-                text = f.read()
+    if not all_chunks:
+        raise ValueError("No knowledge documents found.")
 
-            chunks = [
-                chunk.strip()
-                for chunk in text.split("\n\n")
-                if chunk.strip()
-            ]
+    return all_chunks
 
-            all_chunks.extend(chunks)
 
-    if not all_chunks:
-        raise ValueError("No knowledge documents found.")
+def _chunk_hash(chunk: dict) -> str:
+    return hashlib.sha256(f"{chunk['source']}\0{chunk['text']}".encode("utf-8")).hexdigest()
+
+
+def _chunk_keys(chunks) -> list:
+    """
+    Manifest key per chunk: its content hash plus how many identical
+    chunks came before it, so repeated chunks each keep their own id.
+    """
 
-    embeddings = embedding_model.encode(all_chunks)
-    embeddings = np.array(embeddings).astype("float32")
+    seen = {}
+    keys = []
+    for chunk in chunks:
+        digest = _chunk_hash(chunk)
+        keys.append(f"{digest}:{seen.get(digest, 0)}")
+        seen[digest] = seen.get(digest, 0) + 1
+    return keys
 
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(embeddings)
 
-    faiss.write_index(index, INDEX_PATH)
-    np.save(DOC_STORE_PATH, np.array(all_chunks, dtype=object))
+def _chunk_metadata(chunk: dict) -> dict:
+    return {"source": chunk["source"], "start": chunk["start"], "end": chunk["end"]}
+
+
+def _current_version():
+    """
+    Name of the active version directory, or None before the first build.
+    """
+
+    if not os.path.exists(CURRENT_PATH):
+        return None
+    with open(CURRENT_PATH, "r") as f:
+        return f.read().strip() or None
 
-    print("✅ FAISS L2 index built and saved.")
+
+def _read_manifest(version: str):
+    with open(os.path.join(RAG_DIR, version, MANIFEST_FILE), "r") as f:
+        return json.load(f)
+
+
+def _open_doc_store(path: str) -> TextStore:
+    blob_path = os.path.join(path, DOC_STORE_FILE)
+    offsets_path = os.path.join(path, DOC_OFFSETS_FILE)
+    if not (os.path.exists(blob_path) and os.path.exists(offsets_path)):
+        raise ValueError("FAISS index uses an old doc store format. Run build_index() again.")
+    return TextStore(blob_path, offsets_path)
+
+
+def _publish(index, texts, metadata, embeddings, manifest: dict):
+    """
+    Write a new version directory, then atomically point CURRENT at it.
+    Workers pick the new version up on their next reload check.
+    """
+
+    previous = _current_version()
+    number = int(previous[1:]) + 1 if previous else 1
+    version = f"v{number}"
+    path = os.path.join(RAG_DIR, version)
+
+    os.makedirs(path, exist_ok=True)
+    faiss.write_index(index, os.path.join(path, INDEX_FILE))
+    write_text_store(os.path.join(path, DOC_STORE_FILE), os.path.join(path, DOC_OFFSETS_FILE), texts)
+    with open(os.path.join(path, METADATA_FILE), "w") as f:
+        json.dump(metadata, f)
+    np.save(os.path.join(path, EMBEDDINGS_FILE), embeddings)
+    with open(os.path.join(path, MANIFEST_FILE), "w") as f:
+        json.dump({**manifest, "version": version}, f)
+
+    tmp_path = f"{CURRENT_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(version)
+    os.replace(tmp_path, CURRENT_PATH)
+
+    # Drop old versions beyond KEEP_VERSIONS
+    versions = sorted(
+        (name for name in os.listdir(RAG_DIR) if name.startswith("v") and name[1:].isdigit()),
+        key=lambda name: int(name[1:])
+    )
+    for name in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(RAG_DIR, name), ignore_errors=True)
+
+    return version
+
+
+def build_index(index_type: str = INDEX_TYPE):
+    """
+    Build FAISS index using the configured similarity mode and type.
+    Re-embeds every chunk and compacts chunk ids.
+    Run once before starting API.
+    """
+
+    all_chunks = load_chunks()
+    texts = [chunk["text"] for chunk in all_chunks]
+    embeddings = encode_texts(texts)
+    ids = np.arange(len(all_chunks), dtype="int64")
+
+    index = create_index(embeddings, index_type, ids)
+
+    metadata = [_chunk_metadata(chunk) for chunk in all_chunks]
+
+    version = _publish(index, texts, metadata, embeddings, {
+        "mode": SIMILARITY_MODE,
+        "model": EMBEDDING_MODEL_NAME,
+        "index_type": index_type,
+        "chunk_keys": CHUNK_KEY_FORMAT,
+        "chunks": {key: int(i) for i, key in zip(ids, _chunk_keys(all_chunks))},
+    })
+
+    print(f"✅ FAISS index built and saved ({version}).")
+
+
+def update_index(index_type: str = INDEX_TYPE):
+    """
+    Incrementally apply knowledge document edits to the index.
+
+    Chunks are matched by content hash and occurrence against the
+    current manifest: only new or edited chunks are embedded, and
+    removed ones are deleted from the index by id. Falls back to build_index() when no
+    compatible version exists.
+    """
+
+    previous = _current_version()
+    manifest = _read_manifest(previous) if previous else None
+
+    if (
+        manifest is None
+        or manifest["mode"] != SIMILARITY_MODE
+        or manifest["model"] != EMBEDDING_MODEL_NAME
+        or manifest["index_type"] != index_type
+        or manifest.get("chunk_keys") != CHUNK_KEY_FORMAT
+        or not os.path.exists(os.path.join(RAG_DIR, previous, DOC_OFFSETS_FILE))
+    ):
+        build_index(index_type)
+        return
+
+    path = os.path.join(RAG_DIR, previous)
+    all_chunks = load_chunks()
+    chunks = dict(zip(_chunk_keys(all_chunks), all_chunks))
+    known = manifest["chunks"]
+
+    added = [key for key in chunks if key not in known]
+    removed = [key for key in known if key not in chunks]
+
+    if not added and not removed:
+        print(f"✅ FAISS index up to date ({previous}).")
+        return
+
+    index = faiss.read_index(os.path.join(path, INDEX_FILE))
+    embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE))
+    with open(os.path.join(path, METADATA_FILE), "r") as f:
+        metadata = json.load(f)
+    texts = [
+        text if meta is not None else None
+        for text, meta in zip(_open_doc_store(path), metadata)
+    ]
+
+    # Removed chunks keep their id slot as an empty hole
+    removed_ids = np.array([known.pop(key) for key in removed], dtype="int64")
+    for chunk_id in removed_ids:
+        texts[chunk_id] = None
+        metadata[chunk_id] = None
+
+    new_ids = np.arange(len(texts), len(texts) + len(added), dtype="int64")
+    new_texts = [chunks[key]["text"] for key in added]
+    new_embeddings = encode_texts(new_texts) if added else embeddings[:0]
+
+    texts.extend(new_texts)
+    embeddings = np.vstack([embeddings, new_embeddings])
+    metadata.extend(None for _ in added)
+    known.update({key: int(i) for key, i in zip(added, new_ids)})
+
+    # Unchanged chunks may have moved within their file
+    for key, chunk in chunks.items():
+        metadata[known[key]] = _chunk_metadata(chunk)
+
+    if len(removed_ids) and isinstance(_base_index(index), faiss.IndexHNSW):
+        # HNSW graphs cannot delete; rebuild from the stored embeddings
+        live_ids = np.array(sorted(known.values()), dtype="int64")
+        index = create_index(embeddings[live_ids], index_type, live_ids)
+    else:
+        if len(removed_ids):
+            index.remove_ids(removed_ids)
+        if added:
+            index.add_with_ids(new_embeddings, new_ids)
+
+    version = _publish(index, texts, metadata, embeddings, manifest)
+
+    print(f"✅ FAISS index updated ({version}): {len(added)} added, {len(removed)} removed.")
 
 
 # ---------------------------------------------------
-# 🔹 Load Index Once at Startup
+# 🔹 Load Index at Startup (hot-swapped on update)
 # ---------------------------------------------------
 
-index = None
-doc_store = None
+# (version, index, doc_store, metadata) swapped as one reference so
+# requests never mix an index with another version's doc store
+_active = None
+_checked_at = 0.0
+_load_lock = threading.Lock()
+
 
 def _load_index():
-    global index, doc_store
+    global _active
 
-    if not os.path.exists(INDEX_PATH):
+    version = _current_version()
+    if version is None:
         raise ValueError("FAISS index not found. Run build_index() first.")
 
-    index = faiss.read_index(INDEX_PATH)
-    doc_store = np.load(DOC_STORE_PATH, allow_pickle=True)
+    path = os.path.join(RAG_DIR, version)
+    index = read_shared_index(os.path.join(path, INDEX_FILE))
+    if index.metric_type != index_metric():
+        raise ValueError("FAISS index uses a different similarity mode. Run build_index() again.")
 
+    doc_store = _open_doc_store(path)
+    with open(os.path.join(path, METADATA_FILE), "r") as f:
+        metadata = json.load(f)
 
-# Auto-load if exists
-if os.path.exists(INDEX_PATH):
-    _load_index()
+    _active = (version, index, doc_store, metadata)
+
+
+def _maybe_reload():
+    """
+    Swap to a newly published version without restarting the worker.
+    """
+
+    global _checked_at
+
+    now = time.monotonic()
+    if now - _checked_at < RELOAD_CHECK_INTERVAL:
+        return
+    _checked_at = now
+
+    version = _current_version()
+    if version is not None and (_active is None or _active[0] != version):
+        try:
+            _load_index()
+        except (OSError, ValueError) as exc:
+            print(f"⚠️ Could not load FAISS index {version}: {exc}")
+
+
+def load_index():
+    """
+    Load the current version if one exists. An index built for another
+    mode stays unloaded; until then retrieve_chunks keeps retrying.
+    """
+
+    if _active is not None:
+        return
+
+    with _load_lock:
+        if _active is not None or _current_version() is None:
+            return
+
+        try:
+            _load_index()
+        except ValueError as exc:
+            print(f"⚠️ {exc}")
 
 
 # ---------------------------------------------------
-# 🔹 Retrieve Function (L2 + Custom Similarity)
+# 🔹 Retrieve Function
 # ---------------------------------------------------
 
-def retrieve(query: str, top_k: int = TOP_K_DEFAULT, return_scores: bool = False):
+def retrieve_chunks(query: str, top_k: int = TOP_K_DEFAULT, query_embedding=None,
+                    nprobe: int = None, ef_search: int = None):
     """
-    Retrieve top-k chunks using L2 distance.
-    Converts L2 distance to similarity using:
-        similarity = 1 / (1 + distance)
+    Retrieve top-k chunks with their source, offsets and score.
+    Scores are cosine similarity in cosine mode, or 1 / (1 + distance)
+    in L2 mode.
+    Pass query_embedding to reuse a vector already computed for this request.
+    nprobe (IVF) and ef_search (HNSW) trade recall for latency per query.
     """
 
-    global index, doc_store
+    load_index()
+    _maybe_reload()
 
-    if index is None or doc_store is None:
+    if _active is None:
         raise ValueError("Index not loaded. Run build_index().")
 
-    query_embedding = embedding_model.encode([query]).astype("float32")
+    _, index, doc_store, metadata = _active
+
+    if query_embedding is None:
+        query_embedding = encode_query(query)
 
-    distances, indices = index.search(query_embedding, top_k)
+    params = search_params(index, nprobe=nprobe, ef_search=ef_search)
+    with timed("retrieval"):
+        distances, indices = index.search(query_embedding, top_k, params=params)
 
     results = []
-    similarity_scores = []
 
     for i, idx in enumerate(indices[0]):
-        if idx < len(doc_store):
-            results.append(doc_store[idx])
+        # Holes left by removed chunks have no metadata
+        if 0 <= idx < len(doc_store) and metadata[idx] is not None:
+            results.append({
+                "text": doc_store[idx],
+                **metadata[idx],
+                # Convert FAISS distance → similarity score
+                "score": float(to_similarity(distances[0][i])),
+            })
 
-            # Convert L2 distance → similarity score
-            sim_score = 1 / (1 + distances[0][i])
-            similarity_scores.append(float(sim_score))
+    return results
 
-    if return_scores:
-        return list(zip(results, similarity_scores))
 
-    return results
+def retrieve(query: str, top_k: int = TOP_K_DEFAULT, return_scores: bool = False,
+             query_embedding=None, nprobe: int = None, ef_search: int = None):
+    """
+    Retrieve top-k chunk texts (with scores if return_scores).
+    See retrieve_chunks for the search options.
+    """
+
+    chunks = retrieve_chunks(query, top_k, query_embedding=query_embedding,
+                             nprobe=nprobe, ef_search=ef_search)
+
+    if return_scores:
+        return [(chunk["text"], chunk["score"]) for chunk in chunks]
 
+    return [chunk["text"] for chunk in chunks]
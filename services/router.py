@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+from services.embeddings import EMBEDDING_MODEL_NAME, encode_texts
+
+# ---------------------------------------------------
+# 🔹 Configuration
+# ---------------------------------------------------
+
+# Labelled queries written by generate_dataset.py
+ROUTER_EXAMPLES_PATH = "data/router_examples.json"
+ROUTER_PATH = "models/router.npz"
+
+LABELS = ["block", "dataset", "rag", "slm"]
+
+# Minimum probability for the router to refuse a query on its own;
+# keyword guardrails still block regardless
+BLOCK_THRESHOLD = 0.6
+
+# Softmax regression on the query embedding
+TRAIN_STEPS = 1000
+LEARNING_RATE = 2.0
+L2_PENALTY = 1e-3
+
+
+# ---------------------------------------------------
+# 🔹 Train Router (persisted artifact)
+# ---------------------------------------------------
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def _examples_hash() -> str:
+    """
+    Content hash of the examples plus the embedding model they are
+    encoded with. A mismatch means the saved router is stale.
+    """
+
+    digest = hashlib.sha256(EMBEDDING_MODEL_NAME.encode("utf-8"))
+    with open(ROUTER_EXAMPLES_PATH, "rb") as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+def train_router(embeddings: np.ndarray, labels: np.ndarray):
+    """
+    Fit a class-balanced softmax regression by full-batch gradient descent.
+
+    Returns:
+        (weights: (dim, n_labels), bias: (n_labels,))
+    """
+
+    features = _normalize(embeddings)
+    targets = np.eye(len(LABELS), dtype="float32")[labels]
+
+    # Weight rows so every label counts equally
+    counts = np.bincount(labels, minlength=len(LABELS)).astype("float32")
+    sample_weights = (len(labels) / (len(LABELS) * np.maximum(counts, 1)))[labels]
+    sample_weights /= sample_weights.sum()
+
+    weights = np.zeros((features.shape[1], len(LABELS)), dtype="float32")
+    bias = np.zeros(len(LABELS), dtype="float32")
+
+    for _ in range(TRAIN_STEPS):
+        probabilities = _softmax(features @ weights + bias)
+        error = (probabilities - targets) * sample_weights[:, None]
+        weights -= LEARNING_RATE * (features.T @ error + L2_PENALTY * weights)
+        bias -= LEARNING_RATE * error.sum(axis=0)
+
+    return weights, bias
+
+
+def build_router():
+    """
+    Embed the labelled examples and save the trained router.
+    Run after regenerating the examples.
+    """
+
+    with open(ROUTER_EXAMPLES_PATH, "r") as f:
+        examples = json.load(f)
+
+    texts, labels = [], []
+    for label, queries in examples.items():
+        texts.extend(queries)
+        labels.extend([LABELS.index(label)] * len(queries))
+
+    weights, bias = train_router(encode_texts(texts), np.array(labels))
+
+    os.makedirs(os.path.dirname(ROUTER_PATH), exist_ok=True)
+    tmp_path = f"{ROUTER_PATH}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, weights=weights, bias=bias, hash=np.array(_examples_hash()))
+    os.replace(tmp_path, ROUTER_PATH)
+
+    print("✅ Query router trained and saved.")
+
+
+# ---------------------------------------------------
+# 🔹 Load Router Once (at startup or on first route)
+# ---------------------------------------------------
+
+weights = None
+bias = None
+_loaded = False
+_load_lock = threading.Lock()
+
+
+def _load_router():
+    global weights, bias
+
+    if not os.path.exists(ROUTER_EXAMPLES_PATH):
+        print("⚠️ Router examples not found; routing falls back to keywords.")
+        return
+
+    saved = np.load(ROUTER_PATH) if os.path.exists(ROUTER_PATH) else None
+
+    # Retrain when missing or trained on different examples
+    if saved is None or str(saved["hash"]) != _examples_hash():
+        build_router()
+        saved = np.load(ROUTER_PATH)
+
+    weights, bias = saved["weights"], saved["bias"]
+
+
+def load_router():
+    """
+    Load (or retrain) the router once.
+    """
+
+    global _loaded
+
+    if _loaded:
+        return
+
+    with _load_lock:
+        if not _loaded:
+            _load_router()
+            _loaded = True
+
+
+# ---------------------------------------------------
+# 🔹 Route Function
+# ---------------------------------------------------
+
+def predict(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Label probabilities (rows follow LABELS order) for a batch of
+    query embeddings, in one matrix product.
+    """
+
+    return _softmax(_normalize(np.asarray(embeddings, dtype="float32")) @ weights + bias)
+
+
+def route(query_embedding):
+    """
+    Decide how to answer a query from the embedding already computed
+    for it.
+
+    Returns:
+        (decision: "block" | "dataset" | "rag" | "slm", confidence: float),
+        or (None, 0.0) when no router is loaded.
+
+    "block" is only returned above BLOCK_THRESHOLD. "dataset" means the
+    query looks like a FAQ question even though it missed the dataset
+    tier; the caller picks the generation tier for it with the keyword
+    rules, so near-misses do not all take the costlier RAG path.
+    """
+
+    return route_many(query_embedding)[0]
+
+
+def route_many(query_embeddings):
+    """
+    route() for every row of an (N, dim) embedding matrix at once.
+    """
+
+    load_router()
+
+    if weights is None:
+        return [(None, 0.0)] * len(query_embeddings)
+
+    decisions = []
+    for row in predict(query_embeddings).tolist():
+        probabilities = dict(zip(LABELS, row))
+
+        if probabilities["block"] >= BLOCK_THRESHOLD:
+            decisions.append(("block", probabilities["block"]))
+            continue
+
+        label = max(("dataset", "rag", "slm"), key=probabilities.get)
+        decisions.append((label, probabilities[label]))
+
+    return decisions
@@ -1,46 +1,324 @@
+import hashlib
 import json
+import os
+import threading
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
+from services.embeddings import (
+    EMBEDDING_MODEL_NAME,
+    SIMILARITY_MODE,
+    encode_query,
+    encode_texts,
+    new_flat_index,
+    read_shared_index,
+    to_similarity,
+)
+from services.metrics import timed
+from services.text_store import TextStore, write_text_store
+from services.text_utils import normalize_query
 
-# Load embedding model
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+# ---------------------------------------------------
+# 🔹 Configuration
+# ---------------------------------------------------
 
-# Load dataset
-with open("data/alpaca_dataset.json", "r") as f:
-    dataset = json.load(f)
+DATASET_PATH = "data/alpaca_dataset.json"
 
-# Extract instructions
-instructions = [item["instruction"] for item in dataset]
+# Compiled artifact: index row i answers with answers[answer_ids[i]].
+# The store file is the manifest and is written last.
+DATASET_INDEX_PATH = "models/dataset_index.index"
+DATASET_ANSWERS_PATH = "models/dataset_answers.bin"             # UTF-8 unique answers
+DATASET_ANSWER_OFFSETS_PATH = "models/dataset_answer_offsets.npy"
+DATASET_ANSWER_IDS_PATH = "models/dataset_answer_ids.npy"       # int32 per index row
+DATASET_STORE_PATH = "models/dataset_store.json"
+THRESHOLD_PATH = "models/similarity_threshold.json"
 
-# Generate embeddings
-instruction_embeddings = embedding_model.encode(instructions)
+# Match threshold per SIMILARITY_MODE when no calibration file exists.
+# The cosine value is the old 0.75 L2 cut-off mapped onto unit vectors
+# (squared L2 = 2 - 2 * cosine); calibrate_threshold.py tunes it on
+# the held-out paraphrase set.
+DEFAULT_THRESHOLDS = {"cosine": 0.83, "l2": 0.75}
 
-# Create FAISS index
-dimension = instruction_embeddings.shape[1]
-index = faiss.IndexFlatL2(dimension)
-index.add(np.array(instruction_embeddings))
+# A row is dropped as a near-duplicate when an earlier kept row with
+# the same answer is at least this similar. Far above any match
+# threshold, so queries that matched the dropped row still match.
+DEDUP_THRESHOLDS = {"cosine": 0.97, "l2": 0.94}
 
+# Nearest neighbours checked per row for near-duplicates
+DEDUP_NEIGHBOURS = 16
+DEDUP_SEARCH_BATCH = 4096
 
-def search_similar_query(query, threshold=0.75):
+
+# ---------------------------------------------------
+# 🔹 Compile Dataset Index (persisted artifact)
+# ---------------------------------------------------
+
+def _dataset_hash() -> str:
+    """
+    Content hash of the dataset plus the embedding model, similarity
+    mode and dedup threshold that compiled it. A mismatch means the
+    on-disk index is stale.
+    """
+
+    digest = hashlib.sha256(
+        f"{EMBEDDING_MODEL_NAME}|{SIMILARITY_MODE}|{DEDUP_THRESHOLDS[SIMILARITY_MODE]}".encode("utf-8")
+    )
+    with open(DATASET_PATH, "rb") as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _replace_file(path: str, write):
+    """
+    Write to a temporary file, then atomically move it into place.
+    """
+
+    write(_tmp_path(path))
+    os.replace(_tmp_path(path), path)
+
+
+def _tmp_path(path: str) -> str:
+    # Keeps the extension, which np.save would otherwise append
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid()}.tmp{ext}"
+
+
+def _write_json(path: str, data):
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+def _intern(values: list):
+    """
+    Unique values in first-seen order, and each value's id among them.
+    """
+
+    ids = {}
+    value_ids = [ids.setdefault(value, len(ids)) for value in values]
+    return list(ids), np.array(value_ids, dtype="int32")
+
+
+def _near_duplicates(embeddings, answer_ids) -> np.ndarray:
+    """
+    Mask of rows whose answer an earlier kept row already gives from
+    (almost) the same instruction. Rows are kept greedily in dataset
+    order. A row stays when a row with another answer is at least as
+    close as that match, so searching with a dropped instruction still
+    finds its answer.
+    """
+
+    threshold = DEDUP_THRESHOLDS[SIMILARITY_MODE]
+
+    search_index = new_flat_index(embeddings.shape[1])
+    search_index.add(embeddings)
+
+    k = min(DEDUP_NEIGHBOURS, len(embeddings))
+    dropped = np.zeros(len(embeddings), dtype=bool)
+
+    for start in range(0, len(embeddings), DEDUP_SEARCH_BATCH):
+        distances, neighbours = search_index.search(embeddings[start:start + DEDUP_SEARCH_BATCH], k)
+        scores = to_similarity(distances)
+
+        for offset in range(len(neighbours)):
+            row = start + offset
+            # Closest first
+            for neighbour, score in zip(neighbours[offset], scores[offset]):
+                if score < threshold or neighbour < 0:
+                    break
+                if neighbour == row:
+                    continue
+                if answer_ids[neighbour] != answer_ids[row]:
+                    break
+                if neighbour < row and not dropped[neighbour]:
+                    dropped[row] = True
+                    break
+
+    return dropped
+
+
+def build_dataset_index():
+    """
+    Compile the dataset into the Tier 1 artifact: exact and near-duplicate
+    instructions are dropped, each distinct answer is stored once and
+    index rows point at it by id. Run after regenerating the dataset.
+    """
+
+    with open(DATASET_PATH, "r") as f:
+        dataset = json.load(f)
+
+    # Exact duplicates (after normalization); the first occurrence wins,
+    # as it would in a search over every row
+    seen = set()
+    rows = []
+    for item in dataset:
+        key = normalize_query(item["instruction"])
+        if key not in seen:
+            seen.add(key)
+            rows.append(item)
+
+    answers, answer_ids = _intern([item["output"] for item in rows])
+    instruction_embeddings = encode_texts([item["instruction"] for item in rows])
+
+    keep = ~_near_duplicates(instruction_embeddings, answer_ids)
+    instruction_embeddings = instruction_embeddings[keep]
+    answer_ids = answer_ids[keep]
+
+    dimension = instruction_embeddings.shape[1]
+    dataset_index = new_flat_index(dimension)
+    dataset_index.add(instruction_embeddings)
+
+    store = {
+        "hash": _dataset_hash(),
+        "rows": len(dataset),
+        "unique_instructions": len(rows),
+        "indexed": int(keep.sum()),
+        "answers": len(answers),
+    }
+
+    os.makedirs(os.path.dirname(DATASET_INDEX_PATH), exist_ok=True)
+
+    # Arrays first, manifest last: the manifest's hash marks a complete build
+    _replace_file(DATASET_INDEX_PATH, lambda path: faiss.write_index(dataset_index, path))
+    write_text_store(_tmp_path(DATASET_ANSWERS_PATH), _tmp_path(DATASET_ANSWER_OFFSETS_PATH), answers)
+    os.replace(_tmp_path(DATASET_ANSWERS_PATH), DATASET_ANSWERS_PATH)
+    os.replace(_tmp_path(DATASET_ANSWER_OFFSETS_PATH), DATASET_ANSWER_OFFSETS_PATH)
+    _replace_file(DATASET_ANSWER_IDS_PATH, lambda path: np.save(path, answer_ids))
+    _replace_file(DATASET_STORE_PATH, lambda path: _write_json(path, store))
+
+    print(
+        f"✅ Dataset FAISS index built and saved: {store['indexed']} of {store['rows']} rows "
+        f"indexed, {store['answers']} distinct answers."
+    )
+
+
+# ---------------------------------------------------
+# 🔹 Load Index Once (at startup or on first search)
+# ---------------------------------------------------
+
+class AnswerStore:
+    """
+    Answer per index row, read through the row's answer id from the
+    memory-mapped answer store.
+    """
+
+    def __init__(self, answers: TextStore, answer_ids):
+        self.answers = answers
+        self.answer_ids = answer_ids
+
+    def __len__(self):
+        return len(self.answer_ids)
+
+    def __getitem__(self, row: int) -> str:
+        return self.answers[int(self.answer_ids[row])]
+
+
+index = None
+responses = None
+match_threshold = None
+_load_lock = threading.Lock()
+
+_ARTIFACT_PATHS = (
+    DATASET_INDEX_PATH,
+    DATASET_ANSWERS_PATH,
+    DATASET_ANSWER_OFFSETS_PATH,
+    DATASET_ANSWER_IDS_PATH,
+    DATASET_STORE_PATH,
+)
+
+
+def _read_store():
+    if not all(os.path.exists(path) for path in _ARTIFACT_PATHS):
+        return None
+    with open(DATASET_STORE_PATH, "r") as f:
+        return json.load(f)
+
+
+def _load_dataset_index():
+    global index, responses
+
+    store = _read_store()
+
+    # Rebuild when missing, built from a different dataset or in the
+    # old format that kept every response in the store file
+    if store is None or store.get("hash") != _dataset_hash() or "answers" not in store:
+        build_dataset_index()
+
+    index = read_shared_index(DATASET_INDEX_PATH)
+    responses = AnswerStore(
+        TextStore(DATASET_ANSWERS_PATH, DATASET_ANSWER_OFFSETS_PATH),
+        np.load(DATASET_ANSWER_IDS_PATH, mmap_mode="r"),
+    )
+
+    if len(responses) != index.ntotal:
+        raise ValueError("Dataset answer ids do not match the index. Run build_dataset_index() again.")
+
+
+def _load_threshold() -> float:
+    """
+    Calibrated threshold for the current mode, else the default.
+    """
+
+    global match_threshold
+
+    match_threshold = DEFAULT_THRESHOLDS[SIMILARITY_MODE]
+
+    if os.path.exists(THRESHOLD_PATH):
+        with open(THRESHOLD_PATH, "r") as f:
+            calibration = json.load(f)
+        if calibration.get("mode") == SIMILARITY_MODE and calibration.get("model") == EMBEDDING_MODEL_NAME:
+            match_threshold = float(calibration["threshold"])
+
+    return match_threshold
+
+
+def load_dataset_index():
+    """
+    Load the threshold and the dataset index once, rebuilding the index
+    when it is stale.
+    """
+
+    if index is not None:
+        return
+
+    with _load_lock:
+        if index is None:
+            _load_threshold()
+            _load_dataset_index()
+
+
+def search_similar_query(query, threshold=None, query_embedding=None):
     """
     Returns stored response if similarity above threshold.
+    Uses the calibrated threshold unless one is given.
+    Pass query_embedding to reuse a vector already computed for this request.
     """
 
-    query_embedding = embedding_model.encode([query])
-    distances, indices = index.search(np.array(query_embedding), 1)
+    if query_embedding is None:
+        query_embedding = encode_query(query)
 
+    return search_similar_queries(query_embedding, threshold=threshold)[0]
+
+
+def search_similar_queries(query_embeddings, threshold=None):
     """
-    We can use FAISS with L2 distance. For simplicity in the MVP,
-    we convert distance into a bounded similarity score using 1/(1+d).
-    In future iterations, we plan to switch to cosine similarity with normalized embeddings
-    for better semantic alignment.”
+    Batch form of search_similar_query: one FAISS search over an (N, dim)
+    matrix of query embeddings.
+
+    Returns:
+        [(response or None, score)] in row order
     """
 
-    similarity_score = 1 / (1 + distances[0][0])  # Convert distance to similarity score
+    load_dataset_index()
+
+    if threshold is None:
+        threshold = match_threshold
+
+    with timed("dataset_search"):
+        distances, indices = index.search(np.asarray(query_embeddings, dtype="float32"), 1)
 
-    if similarity_score >= threshold:
-        matched_response = dataset[indices[0][0]]["output"]
-        return matched_response, float(similarity_score)
+    # Cosine similarity, or 1/(1+d) in L2 mode
+    scores = to_similarity(distances[:, 0])
 
-    return None, float(similarity_score)
+    return [
+        (responses[indices[row][0]] if score >= threshold else None, float(score))
+        for row, score in enumerate(scores)
+    ]
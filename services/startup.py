@@ -0,0 +1,174 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from services import embeddings, model, rag, router, similarity
+
+# ---------------------------------------------------
+# 🔹 Configuration
+# ---------------------------------------------------
+
+# Components left out of readiness. They load in the background once
+# the rest are ready, or on the first request that needs them.
+DEFERRED_COMPONENTS = set()
+
+# Loaded before /ready in every configuration: routing runs on each
+# query, and loading the router may train it
+REQUIRED_COMPONENTS = {"router"}
+
+WARMUP_QUERY = "How is my EMI calculated?"
+WARMUP_TOKENS = 4
+
+
+# ---------------------------------------------------
+# 🔹 Warm-up Calls
+# ---------------------------------------------------
+# One representative call per component, so the first real request
+# does not pay for lazy allocations, thread pool start-up or the
+# prompt preamble prefill.
+
+def _warm_embedding():
+    embeddings.encode_query(WARMUP_QUERY)
+
+
+def _warm_dataset():
+    similarity.search_similar_query(WARMUP_QUERY, query_embedding=embeddings.encode_query(WARMUP_QUERY))
+
+
+def _warm_router():
+    router.route(embeddings.encode_query(WARMUP_QUERY))
+
+
+def _warm_rag():
+    rag.retrieve_chunks(WARMUP_QUERY, query_embedding=embeddings.encode_query(WARMUP_QUERY))
+
+
+def _warm_slm():
+    # Also caches the key/values of both prompt preambles
+    for preamble in (model.SLM_PREAMBLE, model.RAG_PREAMBLE):
+        model.engine.generate(preamble + WARMUP_QUERY, WARMUP_TOKENS, tier="warmup", prefix=preamble)
+
+
+# name -> (load, warm up)
+COMPONENTS = {
+    "embedding": (embeddings.load_embedding, _warm_embedding),
+    "dataset": (similarity.load_dataset_index, _warm_dataset),
+    "router": (router.load_router, _warm_router),
+    "rag": (rag.load_index, _warm_rag),
+    "slm": (model.load_slm, _warm_slm),
+}
+
+
+# ---------------------------------------------------
+# 🔹 Parallel Startup with Readiness
+# ---------------------------------------------------
+
+class Startup:
+    """
+    Loads components in parallel and tracks each one's state:
+    pending -> loading -> loaded -> warming -> ready, or failed.
+    Model construction is serialized by services.loading; a model left
+    with weights on the meta device fails its component, so the
+    service never reports ready with it.
+    Deferred components report "deferred" until their turn.
+
+    load() only loads (a pre-fork parent uses it so workers share the
+    memory); start() finishes the job in the background, warm-ups
+    included, and skips whatever is already loaded.
+    """
+
+    def __init__(self, components: dict, deferred=()):
+        self.components = components
+        self.deferred = set(deferred)
+
+        required = self.deferred & REQUIRED_COMPONENTS
+        if required:
+            raise ValueError(f"Components cannot be deferred: {', '.join(sorted(required))}")
+
+        self._lock = threading.Lock()
+        self._status = {
+            name: {"state": "deferred" if name in self.deferred else "pending"}
+            for name in components
+        }
+        self._ready_seconds = None
+
+    def _set(self, name: str, **fields):
+        with self._lock:
+            self._status[name].update(fields)
+
+    def _state(self, name: str) -> str:
+        with self._lock:
+            return self._status[name]["state"]
+
+    def _run(self, name: str, warm: bool):
+        loader, warm_up = self.components[name]
+
+        try:
+            if self._state(name) not in ("loaded", "warming", "ready"):
+                self._set(name, state="loading")
+                started = time.perf_counter()
+                loader()
+                self._set(name, state="loaded", load_seconds=round(time.perf_counter() - started, 3))
+
+            if warm and self._state(name) != "ready":
+                self._set(name, state="warming")
+                started = time.perf_counter()
+                warm_up()
+                self._set(name, state="ready", warm_seconds=round(time.perf_counter() - started, 3))
+
+        except Exception as exc:
+            self._set(name, state="failed", error=f"{type(exc).__name__}: {exc}")
+            print(f"⚠️ Startup of {name} failed: {exc}")
+
+    def _run_all(self, names, warm: bool):
+        with ThreadPoolExecutor(max_workers=max(1, len(names)), thread_name_prefix="startup") as pool:
+            list(pool.map(lambda name: self._run(name, warm), names))
+
+    def load(self, warm: bool = False):
+        """
+        Load every required component in parallel and block until done.
+        """
+
+        self._run_all([name for name in self.components if name not in self.deferred], warm)
+
+    def _start(self):
+        started = time.perf_counter()
+        self.load(warm=True)
+
+        if self.ready():
+            self._ready_seconds = round(time.perf_counter() - started, 3)
+            print(f"✅ Ready in {self._ready_seconds}s.")
+
+        self._run_all(sorted(self.deferred), warm=True)
+
+    def start(self) -> threading.Thread:
+        """
+        Load and warm up in a background thread; ready() turns true
+        once every required component has been warmed up.
+        """
+
+        thread = threading.Thread(target=self._start, name="startup", daemon=True)
+        thread.start()
+        return thread
+
+    def _ready(self) -> bool:
+        return all(
+            status["state"] == "ready"
+            for name, status in self._status.items()
+            if name not in self.deferred
+        )
+
+    def ready(self) -> bool:
+        with self._lock:
+            return self._ready()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self._ready(),
+                "ready_seconds": self._ready_seconds,
+                "components": {name: dict(status) for name, status in self._status.items()},
+            }
+
+
+startup = Startup(COMPONENTS, DEFERRED_COMPONENTS)
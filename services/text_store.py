@@ -0,0 +1,56 @@
+import mmap
+import numpy as np
+
+# ---------------------------------------------------
+# 🔹 Compact Text Store (UTF-8 blob + offsets)
+# ---------------------------------------------------
+# Texts are concatenated into one UTF-8 file; text i is the byte range
+# offsets[i]:offsets[i + 1]. Both files are memory-mapped read-only,
+# so nothing is unpickled and workers share the same pages.
+
+
+def write_text_store(blob_path: str, offsets_path: str, texts):
+    """
+    Write texts as a UTF-8 blob plus an int64 offsets array.
+    None entries are stored as empty ranges.
+    """
+
+    offsets = [0]
+    with open(blob_path, "wb") as f:
+        for text in texts:
+            data = (text or "").encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+
+    np.save(offsets_path, np.array(offsets, dtype="int64"))
+
+
+class TextStore:
+    """
+    Read-only, memory-mapped view of a store written by write_text_store.
+    Indexing decodes only the requested text.
+    """
+
+    def __init__(self, blob_path: str, offsets_path: str):
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+
+        with open(blob_path, "rb") as f:
+            # mmap cannot map an empty file
+            if self.offsets[-1] > 0:
+                self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.blob = b""
+
+        if len(self.blob) != self.offsets[-1]:
+            raise ValueError(f"Text store {blob_path} does not match its offsets.")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.blob[start:end].decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
@@ -0,0 +1,17 @@
+import re
+
+# ---------------------------------------------------
+# 🔹 Query Normalization
+# ---------------------------------------------------
+# Kept free of model imports: the dataset tier and offline tools use it
+# without loading the generation stack.
+
+
+def normalize_query(query: str) -> str:
+    """
+    Cache and dedup key for a query: lowercase, punctuation removed,
+    whitespace collapsed.
+    """
+
+    query = re.sub(r"[^\w\s]", " ", query.lower())
+    return " ".join(query.split())
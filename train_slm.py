@@ -1,6 +1,11 @@
+import argparse
+import hashlib
 import json
+import os
+import shutil
+
 import torch
-from datasets import Dataset
+from datasets import Dataset, load_from_disk
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
@@ -8,63 +13,185 @@ from transformers import (
     Trainer,
     DataCollatorForLanguageModeling
 )
+from transformers.trainer_utils import get_last_checkpoint
+
+# Fine-tunes the SLM on the Alpaca dataset.
+#
+# Examples are tokenized once per dataset version (cached on disk),
+# padded per batch rather than to a fixed length, and batched by similar
+# length so little compute goes to padding. Checkpoints are kept per
+# dataset version; --resume continues from the latest one.
+#
+# --lora trains small low-rank adapters instead of every weight (needs
+# peft). The adapters are saved next to the tokenizer and
+# services/model.py merges them into the base model when loading.
+
+DATASET_PATH = "data/alpaca_dataset.json"
+OUTPUT_DIR = "./models/slm"
+CACHE_DIR = "./models/slm_cache"
+CHECKPOINT_DIR = "./models/slm_checkpoints"
+
+# LoRA adapters on every GPT-2 attention and MLP projection
+LORA_TARGET_MODULES = ["c_attn", "c_proj", "c_fc"]
+
+parser = argparse.ArgumentParser(description="Fine-tune the SLM on the Alpaca dataset.")
+parser.add_argument("--base-model", default="distilgpt2")
+parser.add_argument("--output", default=OUTPUT_DIR)
+parser.add_argument("--epochs", type=float, default=1)
+parser.add_argument("--batch-size", type=int, default=16)
+parser.add_argument("--learning-rate", type=float, help="default: 2e-5, or 2e-4 with --lora")
+parser.add_argument("--max-length", type=int, default=256, help="longer examples are truncated")
+parser.add_argument("--save-steps", type=int, default=200, help="checkpoint interval in optimizer steps")
+parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                    help="data loading and tokenization processes")
+parser.add_argument("--resume", action="store_true", help="continue from the latest checkpoint")
+parser.add_argument("--lora", action="store_true", help="train LoRA adapters instead of the full model")
+parser.add_argument("--lora-rank", type=int, default=16)
+parser.add_argument("--lora-alpha", type=int, default=32)
+args = parser.parse_args()
+
+learning_rate = args.learning_rate or (2e-4 if args.lora else 2e-5)
+
+
+# ---------------------------------------------------
+# 🔹 Tokenized Dataset (cached per data version)
+# ---------------------------------------------------
+
+PROMPT_TEMPLATE = "### Instruction:\n{instruction}\n\n### Response:\n{output}"
 
-# Load dataset
-with open("data/alpaca_dataset.json", "r") as f:
-    data = json.load(f)
 
 def format_example(example):
     return {
-        "text": f"### Instruction:\n{example['instruction']}\n\n### Response:\n{example['output']}"
+        "text": PROMPT_TEMPLATE.format(instruction=example["instruction"], output=example["output"])
     }
 
-formatted_data = [format_example(x) for x in data]
-dataset = Dataset.from_list(formatted_data)
 
-model_name = "distilgpt2"
+def _data_hash() -> str:
+    """
+    Content hash of the dataset and of everything that changes its
+    tokenization; a new hash gets a fresh cache and checkpoint folder.
+    """
+
+    digest = hashlib.sha256(f"{args.base_model}|{args.max_length}|{PROMPT_TEMPLATE}".encode("utf-8"))
+    with open(DATASET_PATH, "rb") as f:
+        digest.update(f.read())
+    return digest.hexdigest()[:16]
+
 
-tokenizer = AutoTokenizer.from_pretrained(model_name)
+data_hash = _data_hash()
+cache_path = os.path.join(CACHE_DIR, data_hash)
+
+tokenizer = AutoTokenizer.from_pretrained(args.base_model)
 tokenizer.pad_token = tokenizer.eos_token
 
-model = AutoModelForCausalLM.from_pretrained(model_name)
-model.config.pad_token_id = tokenizer.eos_token_id
+
+def tokenize_function(batch):
+    # No padding here: the collator pads each batch to its longest row
+    encoded = tokenizer(batch["text"], truncation=True, max_length=args.max_length)
+    encoded["length"] = [len(ids) for ids in encoded["input_ids"]]
+    return encoded
 
 
-def tokenize_function(example):
-    return tokenizer(
-        example["text"],
-        truncation=True,
-        padding="max_length",
-        max_length=256
+if os.path.exists(cache_path):
+    tokenized_dataset = load_from_disk(cache_path)
+    print(f"✅ Loaded tokenized dataset from {cache_path}.")
+else:
+    with open(DATASET_PATH, "r") as f:
+        data = json.load(f)
+
+    dataset = Dataset.from_list([format_example(x) for x in data])
+
+    # Worker processes only pay off on a large dataset
+    tokenized_dataset = dataset.map(
+        tokenize_function,
+        batched=True,
+        remove_columns=dataset.column_names,
+        num_proc=args.workers if len(dataset) >= 10000 else None,
     )
+    tokenized_dataset.save_to_disk(cache_path)
+    print(f"✅ Tokenized dataset cached at {cache_path}.")
+
+
+# ---------------------------------------------------
+# 🔹 Model (full fine-tuning or LoRA adapters)
+# ---------------------------------------------------
+
+model = AutoModelForCausalLM.from_pretrained(args.base_model)
+model.config.pad_token_id = tokenizer.eos_token_id
+
+if args.lora:
+    from peft import LoraConfig, get_peft_model
 
-tokenized_dataset = dataset.map(tokenize_function, batched=True)
+    model = get_peft_model(model, LoraConfig(
+        task_type="CAUSAL_LM",
+        r=args.lora_rank,
+        lora_alpha=args.lora_alpha,
+        lora_dropout=0.05,
+        target_modules=LORA_TARGET_MODULES,
+        fan_in_fan_out=True,   # GPT-2 Conv1D layers store weights transposed
+    ))
+    model.print_trainable_parameters()
+
+
+# ---------------------------------------------------
+# 🔹 Train with Checkpoints
+# ---------------------------------------------------
+
+checkpoint_dir = os.path.join(CHECKPOINT_DIR, f"{data_hash}-{'lora' if args.lora else 'full'}")
 
 training_args = TrainingArguments(
-    output_dir="./models/slm",
-    per_device_train_batch_size=2,
-    num_train_epochs=1,
+    output_dir=checkpoint_dir,
+    per_device_train_batch_size=args.batch_size,
+    num_train_epochs=args.epochs,
+    learning_rate=learning_rate,
     logging_steps=10,
-    save_strategy="epoch",
-    learning_rate=2e-5,
+    save_strategy="steps",
+    save_steps=args.save_steps,
+    save_total_limit=2,
+    train_sampling_strategy="group_by_length",
+    length_column_name="length",
+    dataloader_num_workers=args.workers,
+    dataloader_persistent_workers=args.workers > 0,
+    report_to="none",
     fp16=False  # Keep False for CPU
 )
 
+# Pads each batch to a multiple of 8 tokens and masks padding out of the loss
 data_collator = DataCollatorForLanguageModeling(
     tokenizer=tokenizer,
-    mlm=False
+    mlm=False,
+    pad_to_multiple_of=8
 )
 
 trainer = Trainer(
     model=model,
     args=training_args,
     train_dataset=tokenized_dataset,
-    data_collator=data_collator
+    data_collator=data_collator,
+    processing_class=tokenizer
 )
 
-trainer.train()
+resume_from = get_last_checkpoint(checkpoint_dir) if args.resume and os.path.isdir(checkpoint_dir) else None
+if args.resume and resume_from is None:
+    print(f"⚠️ No checkpoint in {checkpoint_dir}; starting from scratch.")
+
+trainer.train(resume_from_checkpoint=resume_from)
+
+
+# ---------------------------------------------------
+# 🔹 Save (swapped in whole)
+# ---------------------------------------------------
+
+# Written next to the output and swapped in at the end, so a running
+# server never sees a half-written model or leftovers of the other mode
+tmp_dir = f"{args.output.rstrip('/')}.{os.getpid()}.tmp"
+model.save_pretrained(tmp_dir)
+tokenizer.save_pretrained(tmp_dir)
 
-model.save_pretrained("./models/slm")
-tokenizer.save_pretrained("./models/slm")
+old_dir = f"{args.output.rstrip('/')}.{os.getpid()}.old"
+if os.path.exists(args.output):
+    os.replace(args.output, old_dir)
+os.replace(tmp_dir, args.output)
+shutil.rmtree(old_dir, ignore_errors=True)
 
-print("Fine-tuned SLM saved successfully.")
+print(f"Fine-tuned SLM {'adapters' if args.lora else 'model'} saved successfully.")